@@ -0,0 +1,220 @@
+# ai_cache.py - Response cache for AI generations
+"""
+Кэш ответов ИИ перед генераторами ai_client
+
+Два уровня:
+- точное совпадение: (тип генерации, символы по порядку, хэш нормализованной
+  ситуации, версия промпта, доп. ключ — например, выбранный путь);
+- похожие ситуации (опционально): TF-IDF вектор ситуации и косинусная
+  близость среди записей с тем же раскладом символов.
+
+Вытеснение LRU + TTL, счётчики попаданий/промахов для метрик.
+"""
+
+import copy
+import hashlib
+import math
+import re
+import time
+from collections import Counter, OrderedDict
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+from config import AI_CACHE_ENABLED, AI_CACHE_MAX_ENTRIES, AI_CACHE_TTL, AI_CACHE_SIMILARITY
+
+# Длина "основы" слова: грубый стемминг для русского ("работы" ~ "работу")
+STEM_LENGTH = 5
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def normalize_situation(situation: str) -> str:
+    """Нормализовать текст ситуации: регистр, ё, пунктуация, пробелы"""
+    text = situation.lower().replace("ё", "е")
+    return " ".join(_WORD_RE.findall(text))
+
+
+def situation_terms(situation: str) -> Counter:
+    """Термы ситуации (обрезанные до основы слова) с частотами"""
+    return Counter(word[:STEM_LENGTH] for word in normalize_situation(situation).split())
+
+
+class _Entry:
+    __slots__ = ("value", "expires_at", "bucket", "terms")
+
+    def __init__(self, value: Any, expires_at: float, bucket: Tuple, terms: Counter):
+        self.value = value
+        self.expires_at = expires_at
+        self.bucket = bucket
+        self.terms = terms
+
+
+class ResponseCache:
+    """LRU + TTL кэш ответов ИИ с опциональным поиском похожих ситуаций"""
+
+    def __init__(self, max_entries: int = 2048, ttl: float = 86400, similarity_threshold: float = 0.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+
+        self._entries: "OrderedDict[Tuple, _Entry]" = OrderedDict()
+        # bucket (всё, кроме ситуации) -> ключи записей, кандидаты для похожих ситуаций
+        self._buckets: Dict[Tuple, set] = {}
+        # Документная частота термов по закэшированным ситуациям (для IDF)
+        self._doc_freq: Counter = Counter()
+
+        self.counters: Counter = Counter()
+
+    # ---------- ключи ----------
+
+    @staticmethod
+    def _bucket_key(kind: str, symbols: Sequence[str], version: str, extra: str) -> Tuple:
+        return (kind, tuple(symbols), version, extra)
+
+    @staticmethod
+    def _situation_hash(situation: str) -> str:
+        return hashlib.sha1(normalize_situation(situation).encode("utf-8")).hexdigest()
+
+    # ---------- API ----------
+
+    def get(
+        self,
+        kind: str,
+        symbols: Sequence[str],
+        situation: str,
+        version: str,
+        extra: str = ""
+    ) -> Optional[Any]:
+        """Найти ответ: сначала точное совпадение, затем похожая ситуация"""
+        bucket = self._bucket_key(kind, symbols, version, extra)
+        key = bucket + (self._situation_hash(situation),)
+
+        entry = self._live_entry(key)
+        if entry is not None:
+            self.counters[f"{kind}:hit_exact"] += 1
+            return copy.deepcopy(entry.value)
+
+        if self.similarity_threshold > 0:
+            similar_key = self._find_similar(bucket, situation)
+            if similar_key is not None:
+                self._entries.move_to_end(similar_key)
+                self.counters[f"{kind}:hit_similar"] += 1
+                return copy.deepcopy(self._entries[similar_key].value)
+
+        self.counters[f"{kind}:miss"] += 1
+        return None
+
+    def set(
+        self,
+        kind: str,
+        symbols: Sequence[str],
+        situation: str,
+        version: str,
+        value: Any,
+        extra: str = ""
+    ):
+        """Сохранить ответ (fallback-ответы кэшировать не нужно)"""
+        bucket = self._bucket_key(kind, symbols, version, extra)
+        key = bucket + (self._situation_hash(situation),)
+
+        if key in self._entries:
+            self._remove(key)
+
+        terms = situation_terms(situation)
+        self._entries[key] = _Entry(copy.deepcopy(value), time.monotonic() + self.ttl, bucket, terms)
+        self._buckets.setdefault(bucket, set()).add(key)
+        self._doc_freq.update(terms.keys())
+
+        while len(self._entries) > self.max_entries:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.counters["evictions"] += 1
+
+    def clear(self):
+        """Очистить кэш (счётчики сохраняются)"""
+        self._entries.clear()
+        self._buckets.clear()
+        self._doc_freq.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Размер кэша и счётчики попаданий/промахов по типам генераций"""
+        hits = sum(v for k, v in self.counters.items() if ":hit" in k)
+        misses = sum(v for k, v in self.counters.items() if k.endswith(":miss"))
+        total = hits + misses
+        return {
+            "size": len(self._entries),
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / total * 100, 1) if total else 0,
+            "counters": dict(self.counters)
+        }
+
+    # ---------- внутреннее ----------
+
+    def _live_entry(self, key: Tuple) -> Optional[_Entry]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at <= time.monotonic():
+            self._remove(key)
+            self.counters["expirations"] += 1
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _remove(self, key: Tuple):
+        entry = self._entries.pop(key)
+        keys = self._buckets.get(entry.bucket)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._buckets[entry.bucket]
+        self._doc_freq.subtract(entry.terms.keys())
+        for term in entry.terms:
+            if self._doc_freq[term] <= 0:
+                del self._doc_freq[term]
+
+    def _tfidf(self, terms: Counter) -> Dict[str, float]:
+        docs = len(self._entries)
+        return {
+            term: tf * (math.log((1 + docs) / (1 + self._doc_freq.get(term, 0))) + 1)
+            for term, tf in terms.items()
+        }
+
+    def _find_similar(self, bucket: Tuple, situation: str) -> Optional[Tuple]:
+        candidates = self._buckets.get(bucket)
+        if not candidates:
+            return None
+
+        query = self._tfidf(situation_terms(situation))
+        query_norm = math.sqrt(sum(w * w for w in query.values()))
+        if not query_norm:
+            return None
+
+        best_key, best_score = None, 0.0
+        now = time.monotonic()
+        for key in list(candidates):
+            entry = self._entries[key]
+            if entry.expires_at <= now:
+                self._remove(key)
+                self.counters["expirations"] += 1
+                continue
+            vector = self._tfidf(entry.terms)
+            norm = math.sqrt(sum(w * w for w in vector.values()))
+            if not norm:
+                continue
+            dot = sum(w * vector.get(term, 0.0) for term, w in query.items())
+            score = dot / (query_norm * norm)
+            if score > best_score:
+                best_key, best_score = key, score
+
+        if best_score >= self.similarity_threshold:
+            return best_key
+        return None
+
+
+# Общий кэш для всех генераторов (None, если кэш выключен)
+response_cache = ResponseCache(
+    max_entries=AI_CACHE_MAX_ENTRIES,
+    ttl=AI_CACHE_TTL,
+    similarity_threshold=AI_CACHE_SIMILARITY
+) if AI_CACHE_ENABLED else None
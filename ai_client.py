@@ -3,51 +3,146 @@
 ИИ клиент для генерации метафорических интерпретаций на основе бросков кубиков
 """
 
-from openai import OpenAI
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+import asyncio
+import functools
+import httpx
+import json
 import os
-from typing import List, Dict
-from config import OPENAI_API_KEY, AI_MODEL, AI_TEMPERATURE, AI_MAX_TOKENS
+import time
+from typing import List, Dict, AsyncIterator, Awaitable, Callable, Hashable, Optional
+from config import (
+    OPENAI_API_KEY, AI_MODEL, AI_TEMPERATURE, AI_MAX_TOKENS, AI_LATENCY_BUDGET,
+    AI_HTTP2, AI_POOL_MAX_CONNECTIONS, AI_POOL_MAX_KEEPALIVE, AI_KEEPALIVE_EXPIRY,
+    AI_CONNECT_TIMEOUT, AI_READ_TIMEOUT, AI_PREWARM_CONNECTIONS
+)
 from dice_meanings import get_symbol_info, STORY_PATHS
+from ai_cache import response_cache
+from ai_resilience import call_with_resilience, stats as resilience_stats
+from ai_metrics import metrics
+from ai_governor import (
+    governor, estimate_tokens,
+    PRIORITY_FLOW_END, PRIORITY_FOLLOW_UP, PRIORITY_NEW_THROW, PRIORITY_SPECULATIVE
+)
+from interpretation_library import compose_interpretation
+
+
+def _build_http_client() -> httpx.AsyncClient:
+    """Общий пул соединений к OpenAI: лимиты, keep-alive, HTTP/2, раздельные таймауты"""
+    http2 = AI_HTTP2
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            print("[⚠️] AI_HTTP2 включён, но пакет h2 не установлен — используем HTTP/1.1")
+            http2 = False
+
+    return DefaultAsyncHttpxClient(
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=AI_POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=AI_POOL_MAX_KEEPALIVE,
+            keepalive_expiry=AI_KEEPALIVE_EXPIRY
+        ),
+        # Общий дедлайн вызова задаёт ai_resilience, здесь — ограничения по фазам
+        timeout=httpx.Timeout(
+            connect=AI_CONNECT_TIMEOUT,
+            read=AI_READ_TIMEOUT,
+            write=AI_CONNECT_TIMEOUT,
+            pool=AI_READ_TIMEOUT
+        )
+    )
 
-# Инициализация клиента OpenAI
-client = OpenAI(api_key=OPENAI_API_KEY)
 
+# Инициализация асинхронного клиента OpenAI
+# (вызовы не блокируют event loop бота). Один пул соединений на все генераторы.
+# Повторы делает ai_resilience, поэтому встроенные повторы SDK выключены
+client = AsyncOpenAI(api_key=OPENAI_API_KEY, max_retries=0, http_client=_build_http_client())
 
-def generate_interpretation(
-    situation: str,
-    symbols: List[str],
-    user_context: str = None
-) -> str:
-    """
-    Генерирует метафорическую интерпретацию на основе ситуации и символов кубиков
+# Версия промптов — входит в ключ кэша. Увеличивайте при изменении промптов,
+# чтобы не отдавать ответы, сгенерированные старой версией
+PROMPT_VERSION = "1"
 
-    Args:
-        situation: описание ситуации пользователя
-        symbols: список выпавших символов (1-3)
-        user_context: дополнительный контекст о пользователе
 
-    Returns:
-        str: интерпретация в форме истории
+# Колбэк "вы в очереди": вызывается, если запрос ждёт слот в ai_governor
+QueueNotice = Optional[Callable[[], Awaitable]]
+
+
+async def _create_completion(
+    kind: str,
+    priority: int,
+    on_queued: QueueNotice = None,
+    tag: Hashable = None,
+    **request
+):
     """
+    Запрос chat completion через общий регулятор (ai_governor)
+    с дедлайном, повторами и circuit breaker (ai_resilience)
 
-    # Получаем значения символов
-    symbol_meanings = [get_symbol_info(s) for s in symbols]
+    tag — метка запроса в очереди регулятора (для governor.promote)
+    """
+    estimated = estimate_tokens(request["messages"], request.get("max_tokens", AI_MAX_TOKENS))
 
-    # Позиции для 6 кубиков
-    positions = ["Корень", "Внешнее", "Внутреннее", "Тень", "Дар", "Шаг"]
+    async def attempt(ticket):
+        started = time.monotonic()
+        response = await client.chat.completions.create(**request)
+        metrics.record_completion(
+            kind, response.model, time.monotonic() - started, response.usage, ticket.wait_time
+        )
+        if response.usage:
+            ticket.settle(response.usage.total_tokens)
+        return response
+
+    # Повторы встают в очередь заново — пользователю сообщаем один раз.
+    # Дубликат hedge не сообщает: первый запрос уже выполняется
+    noticed = False
+
+    async def notice_once():
+        nonlocal noticed
+        if not noticed:
+            noticed = True
+            await on_queued()
+
+    def slot(duplicate: bool):
+        notice = notice_once if on_queued is not None and not duplicate else None
+        return governor.slot(priority, estimated, notice, tag)
+
+    # Слот берётся в ai_resilience: дедлайн и breaker не учитывают ожидание в очереди
+    return await call_with_resilience(kind, attempt, slot=slot)
 
-    # Формируем описание символов для промпта с позициями
-    symbols_description = ""
-    for i, (position, symbol, info) in enumerate(zip(positions, symbols, symbol_meanings), 1):
-        symbols_description += f"\n{i}. **{position}** — {symbol} {info['name']} ({info['keyword']})"
-        symbols_description += f"\n   Архетип: {info.get('archetype', info['keyword'])}"
-        symbols_description += f"\n   Значение: {info['meaning'][:150]}..."
-        if 'light' in info and 'shadow' in info:
-            symbols_description += f"\n   Свет/Тень: {info['light']} / {info['shadow']}"
-        symbols_description += "\n"
 
-    # Системный промпт
-    system_prompt = """Ты — честный провокатор мысли, не аналитик и не психолог.
+def _instrumented(generator: str):
+    """Декоратор: полная длительность и число вызовов генератора в ai_metrics"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.monotonic()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                metrics.record_generation(generator, time.monotonic() - started)
+        return wrapper
+    return decorator
+
+
+def _cache_get(kind: str, symbols: List[str], situation: str, extra: str = ""):
+    """Ответ из кэша или None"""
+    if response_cache is None:
+        return None
+    cached = response_cache.get(kind, symbols, situation, PROMPT_VERSION, extra)
+    if cached is not None:
+        metrics.record_cache_hit(kind)
+    return cached
+
+
+def _cache_set(kind: str, symbols: List[str], situation: str, value, extra: str = ""):
+    """Положить успешный ответ в кэш"""
+    if response_cache is not None:
+        response_cache.set(kind, symbols, situation, PROMPT_VERSION, value, extra)
+
+
+# Системный промпт для интерпретации
+INTERPRETATION_SYSTEM_PROMPT = """Ты — честный провокатор мысли, не аналитик и не психолог.
 
 Твоя задача: дать структурированную интерпретацию через символы (60-100 слов, не больше).
 
@@ -149,6 +244,26 @@ def generate_interpretation(
 
 Тон: прямой, честный, без поэзии. Как умный друг, который говорит неудобную правду."""
 
+
+def _build_interpretation_messages(situation: str, symbols: List[str]) -> List[Dict[str, str]]:
+    """Собрать сообщения для запроса интерпретации"""
+
+    # Получаем значения символов
+    symbol_meanings = [get_symbol_info(s) for s in symbols]
+
+    # Позиции для 6 кубиков
+    positions = ["Корень", "Внешнее", "Внутреннее", "Тень", "Дар", "Шаг"]
+
+    # Формируем описание символов для промпта с позициями
+    symbols_description = ""
+    for i, (position, symbol, info) in enumerate(zip(positions, symbols, symbol_meanings), 1):
+        symbols_description += f"\n{i}. **{position}** — {symbol} {info['name']} ({info['keyword']})"
+        symbols_description += f"\n   Архетип: {info.get('archetype', info['keyword'])}"
+        symbols_description += f"\n   Значение: {info['meaning'][:150]}..."
+        if 'light' in info and 'shadow' in info:
+            symbols_description += f"\n   Свет/Тень: {info['light']} / {info['shadow']}"
+        symbols_description += "\n"
+
     # Пользовательский промпт
     user_prompt = f"""Ситуация человека:
 "{situation}"
@@ -157,13 +272,123 @@ def generate_interpretation(
 
 Создай для этого человека метафорическую интерпретацию - короткую историю-зеркало, которая поможет увидеть ситуацию по-новому."""
 
+    return [
+        {"role": "system", "content": INTERPRETATION_SYSTEM_PROMPT},
+        {"role": "user", "content": user_prompt}
+    ]
+
+
+# Живые запросы, которые продолжают выполняться после истечения бюджета задержки
+# (их результат попадёт в кэш)
+_background_requests = set()
+
+
+async def _within_latency_budget(generator: str, request, fallback):
+    """
+    Гонка живого запроса с бюджетом AI_LATENCY_BUDGET
+
+    Если ответ не успел — возвращает fallback(), а запрос доживает в фоне
+    и наполняет кэш для следующих бросков. Ошибка запроса тоже даёт
+    fallback(). Fallback учитывается в метриках один раз на запрос:
+    ошибка фонового запроса после истечения бюджета повторно не считается.
+    """
+    task = asyncio.ensure_future(request)
     try:
-        response = client.chat.completions.create(
+        if AI_LATENCY_BUDGET <= 0:
+            return await task
+        return await asyncio.wait_for(asyncio.shield(task), AI_LATENCY_BUDGET)
+    except asyncio.TimeoutError:
+        # TimeoutError самого запроса (дедлайн) — обычная ошибка, он уже завершён
+        if not task.done():
+            print(f"[⏱️] Бюджет задержки {AI_LATENCY_BUDGET}с исчерпан, отдаём библиотеку")
+            _background_requests.add(task)
+            task.add_done_callback(_finish_background_request)
+    except Exception:
+        pass  # ошибку уже вывел сам запрос
+
+    metrics.record_fallback(generator)
+    return fallback()
+
+
+def _finish_background_request(task: asyncio.Task):
+    """Фоновый запрос завершён: fallback за него уже учтён, ошибку он вывел сам"""
+    _background_requests.discard(task)
+    if not task.cancelled():
+        task.exception()
+
+
+def _check_interpretation_length(interpretation: str):
+    """Предупредить, если интерпретация вышла длиннее формата"""
+    word_count = len(interpretation.split())
+    if word_count > 120:
+        print(f"[⚠️] Интерпретация слишком длинная: {word_count} слов")
+
+
+# Дополнение к системному промпту для режима одного запроса (generate_reading)
+READING_JSON_INSTRUCTIONS = """
+
+ДОПОЛНИТЕЛЬНО: предложи описания для 4 путей действия — без сахара, прямо и честно:
+- change (Прыгнуть) — действовать сейчас, идти в неизвестное
+- stay (Защитить) — остаться, укрепить текущее
+- patience (Выдержать) — не решать сейчас, дать времени
+- explore (Разведать) — собрать больше данных
+
+Каждое описание: 1-2 предложения, конкретно, с рисками и возможностями,
+в форме прямого обращения ("Сделай...", "Останься...", "Подожди...").
+
+Ответ верни СТРОГО в JSON:
+{"interpretation": "<интерпретация в формате выше, с переносами строк>",
+ "paths": {"change": "...", "stay": "...", "patience": "...", "explore": "..."}}"""
+
+# Fallback описания путей, если ИИ недоступен
+FALLBACK_PATHS = {
+    "change": "Прыгни. Действуй сейчас, разберёшься по ходу.",
+    "stay": "Останься. Укрепи то, что уже работает.",
+    "patience": "Выдержи. Не все решения требуют скорости.",
+    "explore": "Разведай. Узнай больше, прежде чем двигаться."
+}
+
+
+@_instrumented("interpretation")
+async def generate_interpretation(
+    situation: str,
+    symbols: List[str],
+    user_context: str = None,
+    on_queued: QueueNotice = None
+) -> str:
+    """
+    Генерирует метафорическую интерпретацию на основе ситуации и символов кубиков
+
+    Args:
+        situation: описание ситуации пользователя
+        symbols: список выпавших символов (1-3)
+        user_context: дополнительный контекст о пользователе
+        on_queued: колбэк, если запрос встал в очередь ai_governor
+
+    Returns:
+        str: интерпретация в форме истории
+    """
+
+    cached = _cache_get("interpretation", symbols, situation)
+    if cached is not None:
+        return cached
+
+    return await _within_latency_budget(
+        "interpretation",
+        _request_interpretation(situation, symbols, on_queued),
+        lambda: generate_fallback_interpretation(symbols)
+    )
+
+
+async def _request_interpretation(situation: str, symbols: List[str], on_queued: QueueNotice = None) -> str:
+    """Живой запрос интерпретации к OpenAI (fallback при ошибке — в _within_latency_budget)"""
+    try:
+        response = await _create_completion(
+            "interpretation",
+            PRIORITY_NEW_THROW,
+            on_queued,
             model=AI_MODEL,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
+            messages=_build_interpretation_messages(situation, symbols),
             temperature=0.6,
             max_tokens=250
         )
@@ -171,22 +396,110 @@ def generate_interpretation(
         interpretation = response.choices[0].message.content.strip()
 
         # Проверка длины
-        word_count = len(interpretation.split())
-        if word_count > 120:
-            print(f"[⚠️] Интерпретация слишком длинная: {word_count} слов")
+        _check_interpretation_length(interpretation)
 
+        _cache_set("interpretation", symbols, situation, interpretation)
         return interpretation
 
     except Exception as e:
         print(f"[❌] Ошибка GPT: {e}")
-        # Fallback интерпретация
-        return generate_fallback_interpretation(symbols)
+        raise
 
 
-def generate_path_suggestions(
+async def stream_interpretation(
     situation: str,
     symbols: List[str],
-    interpretation: str
+    on_queued: QueueNotice = None
+) -> AsyncIterator[str]:
+    """
+    Потоковая версия generate_interpretation
+
+    Отдаёт накопленный текст интерпретации по мере прихода токенов.
+    Последнее отданное значение — итоговый текст. При ошибке до или во время
+    стрима, а также если первый токен не пришёл за AI_LATENCY_BUDGET,
+    отдаётся fallback интерпретация.
+
+    Args:
+        situation: описание ситуации пользователя
+        symbols: список выпавших символов
+        on_queued: колбэк, если запрос встал в очередь ai_governor
+
+    Yields:
+        str: текст интерпретации, накопленный к текущему моменту
+    """
+
+    started = time.monotonic()
+    cached = _cache_get("interpretation", symbols, situation)
+    if cached is not None:
+        metrics.record_generation("interpretation", time.monotonic() - started)
+        yield cached
+        return
+
+    text = ""
+    try:
+        messages = _build_interpretation_messages(situation, symbols)
+
+        # Бюджет задержки действует до первого токена (включая ожидание в очереди)
+        async with asyncio.timeout(AI_LATENCY_BUDGET or None) as first_token_deadline:
+            # Слот регулятора держим, пока читаем стрим
+            async with governor.slot(PRIORITY_NEW_THROW, estimate_tokens(messages, 250), on_queued) as ticket:
+                # Повторы и breaker — только на открытие стрима, без hedging
+                stream = await call_with_resilience(
+                    "interpretation_stream",
+                    lambda: client.chat.completions.create(
+                        model=AI_MODEL,
+                        messages=messages,
+                        temperature=0.6,
+                        max_tokens=250,
+                        stream=True,
+                        stream_options={"include_usage": True}
+                    ),
+                    hedge=False
+                )
+
+                async for chunk in stream:
+                    if chunk.usage:
+                        ticket.settle(chunk.usage.total_tokens)
+                        metrics.record_completion(
+                            "interpretation_stream", chunk.model, time.monotonic() - started,
+                            chunk.usage, ticket.wait_time
+                        )
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        if not text:
+                            first_token_deadline.reschedule(None)
+                            metrics.record_first_token("interpretation_stream", time.monotonic() - started)
+                        text += delta
+                        yield text
+
+    except TimeoutError:
+        print(f"[⏱️] Первый токен не пришёл за {AI_LATENCY_BUDGET}с, отдаём библиотеку")
+        text = ""
+    except Exception as e:
+        print(f"[❌] Ошибка GPT (стрим): {e}")
+        text = ""
+
+    metrics.record_generation("interpretation", time.monotonic() - started)
+
+    interpretation = text.strip()
+    if not interpretation:
+        metrics.record_fallback("interpretation")
+        yield generate_fallback_interpretation(symbols)
+        return
+
+    _check_interpretation_length(interpretation)
+    _cache_set("interpretation", symbols, situation, interpretation)
+    yield interpretation
+
+
+@_instrumented("paths")
+async def generate_path_suggestions(
+    situation: str,
+    symbols: List[str],
+    interpretation: str,
+    on_queued: QueueNotice = None
 ) -> Dict[str, str]:
     """
     Генерирует варианты путей действия на основе интерпретации
@@ -195,6 +508,7 @@ def generate_path_suggestions(
         situation: ситуация пользователя
         symbols: выпавшие символы
         interpretation: базовая интерпретация
+        on_queued: колбэк, если запрос встал в очередь ai_governor
 
     Returns:
         dict: {path_key: описание пути}
@@ -225,8 +539,15 @@ stay: [описание]
 patience: [описание]
 explore: [описание]"""
 
+    cached = _cache_get("paths", symbols, situation)
+    if cached is not None:
+        return cached
+
     try:
-        response = client.chat.completions.create(
+        response = await _create_completion(
+            "paths",
+            PRIORITY_FOLLOW_UP,
+            on_queued,
             model=AI_MODEL,
             messages=[
                 {"role": "system", "content": system_prompt},
@@ -247,24 +568,120 @@ explore: [описание]"""
                 if key in STORY_PATHS:
                     paths[key] = desc.strip()
 
+        if paths:
+            _cache_set("paths", symbols, situation, paths)
         return paths
 
     except Exception as e:
         print(f"[❌] Ошибка генерации путей: {e}")
+        metrics.record_fallback("paths")
         # Fallback пути
-        return {
-            "change": "Прыгни. Действуй сейчас, разберёшься по ходу.",
-            "stay": "Останься. Укрепи то, что уже работает.",
-            "patience": "Выдержи. Не все решения требуют скорости.",
-            "explore": "Разведай. Узнай больше, прежде чем двигаться."
+        return dict(FALLBACK_PATHS)
+
+
+@_instrumented("reading")
+async def generate_reading(
+    situation: str,
+    symbols: List[str],
+    on_queued: QueueNotice = None
+) -> Dict:
+    """
+    Интерпретация и описания 4 путей за один запрос (структурированный JSON)
+
+    Заменяет пару generate_interpretation + generate_path_suggestions:
+    один round-trip вместо двух, ситуация и символы отправляются один раз.
+
+    Args:
+        situation: описание ситуации пользователя
+        symbols: список выпавших символов
+        on_queued: колбэк, если запрос встал в очередь ai_governor
+
+    Returns:
+        dict: {"interpretation": str, "paths": {path_key: описание пути}}
+    """
+
+    cached = _cache_get("reading", symbols, situation)
+    if cached is not None:
+        return cached
+
+    return await _within_latency_budget(
+        "reading",
+        _request_reading(situation, symbols, on_queued),
+        lambda: {
+            "interpretation": generate_fallback_interpretation(symbols),
+            "paths": dict(FALLBACK_PATHS)
         }
+    )
+
+
+async def _request_reading(situation: str, symbols: List[str], on_queued: QueueNotice = None) -> Dict:
+    """Живой запрос generate_reading к OpenAI (fallback при ошибке — в _within_latency_budget)"""
+    messages = _build_interpretation_messages(situation, symbols)
+    messages[0] = {"role": "system", "content": INTERPRETATION_SYSTEM_PROMPT + READING_JSON_INSTRUCTIONS}
+
+    try:
+        response = await _create_completion(
+            "reading",
+            PRIORITY_NEW_THROW,
+            on_queued,
+            model=AI_MODEL,
+            messages=messages,
+            temperature=0.6,
+            max_tokens=AI_MAX_TOKENS,
+            response_format={"type": "json_object"}
+        )
+
+        reading = parse_reading(response.choices[0].message.content)
+        _check_interpretation_length(reading["interpretation"])
+
+        _cache_set("reading", symbols, situation, reading)
+        return reading
+
+    except Exception as e:
+        print(f"[❌] Ошибка генерации чтения: {e}")
+        raise
+
+
+def parse_reading(raw: str) -> Dict:
+    """
+    Разобрать и проверить JSON ответа generate_reading
+
+    Интерпретация обязательна (иначе ValueError). Пути проверяются по
+    STORY_PATHS: лишние ключи отбрасываются, недостающие берутся из FALLBACK_PATHS.
+    """
+    data = json.loads(raw)
+    if not isinstance(data, dict):
+        raise ValueError("reading is not a JSON object")
 
+    interpretation = data.get("interpretation")
+    if not isinstance(interpretation, str) or not interpretation.strip():
+        raise ValueError("reading has no interpretation")
 
-def generate_reflection_prompts(
+    raw_paths = data.get("paths")
+    if not isinstance(raw_paths, dict):
+        raw_paths = {}
+
+    paths = {}
+    for key in STORY_PATHS:
+        desc = raw_paths.get(key)
+        if isinstance(desc, str) and desc.strip():
+            paths[key] = desc.strip()
+        else:
+            paths[key] = FALLBACK_PATHS[key]
+
+    return {"interpretation": interpretation.strip(), "paths": paths}
+
+
+@_instrumented("reflection")
+async def generate_reflection_prompts(
     situation: str,
     chosen_path: str,
-    symbols: List[str]
-) -> List[str]:
+    symbols: List[str],
+    priority: int = PRIORITY_FLOW_END,
+    on_queued: QueueNotice = None,
+    tag: Hashable = None,
+    fallback: bool = True
+) -> Optional[List[str]]:
     """
     Генерирует journaling-подсказки на основе выбранного пути
 
@@ -272,6 +689,10 @@ def generate_reflection_prompts(
         situation: ситуация пользователя
         chosen_path: выбранный путь (change/stay/patience/explore)
         symbols: выпавшие символы
+        priority: приоритет в очереди ai_governor
+        on_queued: колбэк, если запрос встал в очередь ai_governor
+        tag: метка запроса в очереди ai_governor
+        fallback: при ошибке вернуть общие вопросы (False — вернуть None)
 
     Returns:
         list: список вопросов для рефлексии (3-5 штук)
@@ -299,8 +720,17 @@ def generate_reflection_prompts(
 
 Создай 3 вопроса, начиная каждый с •"""
 
+    # Символы в промпт не входят, поэтому ключ — ситуация и путь
+    cached = _cache_get("reflection", [], situation, extra=chosen_path)
+    if cached is not None:
+        return cached
+
     try:
-        response = client.chat.completions.create(
+        response = await _create_completion(
+            "reflection",
+            priority,
+            on_queued,
+            tag,
             model=AI_MODEL,
             messages=[
                 {"role": "system", "content": system_prompt},
@@ -322,10 +752,16 @@ def generate_reflection_prompts(
                 if clean_line:
                     prompts.append(clean_line)
 
-        return prompts[:3]  # Ровно 3
+        prompts = prompts[:3]  # Ровно 3
+        if prompts:
+            _cache_set("reflection", [], situation, prompts, extra=chosen_path)
+        return prompts
 
     except Exception as e:
         print(f"[❌] Ошибка генерации подсказок: {e}")
+        if not fallback:
+            return None
+        metrics.record_fallback("reflection")
         # Fallback вопросы
         return [
             "Что конкретно я сделаю в ближайшие 48 часов?",
@@ -334,8 +770,54 @@ def generate_reflection_prompts(
         ]
 
 
+def _speculation_tag(throw_id: int, path_key: str) -> tuple:
+    return ("reflection", throw_id, path_key)
+
+
+def start_speculative_reflection_prompts(
+    situation: str,
+    symbols: List[str],
+    path_keys: List[str],
+    throw_id: int
+) -> Dict[str, asyncio.Task]:
+    """
+    Фоновая генерация подсказок для нескольких путей, пока пользователь выбирает
+
+    Запросы идут с низшим приоритетом в очереди ai_governor, по задаче на
+    путь. Задача возвращает вопросы или None, если генерация не удалась:
+    общие fallback-вопросы за результат спекуляции не выдаются.
+
+    Returns:
+        dict: {path_key: задача}
+    """
+    return {
+        path_key: asyncio.ensure_future(generate_reflection_prompts(
+            situation, path_key, symbols,
+            priority=PRIORITY_SPECULATIVE,
+            tag=_speculation_tag(throw_id, path_key),
+            fallback=False
+        ))
+        for path_key in path_keys
+    }
+
+
+def promote_speculative_reflection(throw_id: int, path_key: str) -> bool:
+    """
+    Пользователь выбрал путь: если спекулятивный запрос для него ещё ждёт
+    слот, он обслуживается с приоритетом PRIORITY_FLOW_END
+
+    Returns:
+        bool: запрос был в очереди и поднят
+    """
+    return governor.promote(_speculation_tag(throw_id, path_key), PRIORITY_FLOW_END) > 0
+
+
 def generate_fallback_interpretation(symbols: List[str]) -> str:
-    """Fallback интерпретация если ИИ недоступен"""
+    """Fallback интерпретация если ИИ недоступен: из офлайн-библиотеки или по шаблону"""
+
+    library_text = compose_interpretation(symbols)
+    if library_text:
+        return library_text
 
     # Получаем информацию для ключевых позиций
     info_0 = get_symbol_info(symbols[0])  # Корень
@@ -356,16 +838,46 @@ def generate_fallback_interpretation(symbols: List[str]) -> str:
     return text
 
 
-def test_ai_connection() -> bool:
-    """Тест подключения к OpenAI"""
+async def warm_up_ai_client(connections: int = AI_PREWARM_CONNECTIONS) -> bool:
+    """
+    Прогреть пул соединений: TLS-рукопожатия до первого пользовательского запроса
+
+    Параллельные запросы метаданных модели (без расхода токенов) открывают
+    до `connections` соединений, которые остаются в пуле keep-alive.
+    """
+    if connections <= 0:
+        return True
     try:
-        response = client.chat.completions.create(
-            model=AI_MODEL,
-            messages=[{"role": "user", "content": "Привет!"}],
-            max_tokens=10
-        )
-        print("[✅] OpenAI API работает!")
+        await asyncio.gather(*[client.models.retrieve(AI_MODEL) for _ in range(connections)])
         return True
     except Exception as e:
-        print(f"[❌] Ошибка подключения к OpenAI: {e}")
+        print(f"[⚠️] Не удалось прогреть соединения с OpenAI: {e}")
         return False
+
+
+def ai_gauges() -> Dict[str, float]:
+    """Текущее состояние кэша, регулятора и circuit breaker для /metrics"""
+    gauges = {}
+    if response_cache is not None:
+        gauges["ai_cache_entries"] = response_cache.stats()["size"]
+    governor_stats = governor.stats()
+    gauges["ai_governor_active"] = governor_stats["active"]
+    gauges["ai_governor_queue"] = governor_stats["queue"]
+    gauges["ai_governor_queue_timeouts"] = governor_stats["timeouts"]
+    breaker_state = resilience_stats()["breaker"]
+    gauges["ai_breaker_open"] = 0 if breaker_state == "closed" else 1
+    return gauges
+
+
+async def close_ai_client():
+    """Закрыть пул соединений к OpenAI"""
+    await client.close()
+
+
+async def test_ai_connection() -> bool:
+    """Тест подключения к OpenAI (через общий пул, без расхода токенов)"""
+    if await warm_up_ai_client(connections=1):
+        print("[✅] OpenAI API работает!")
+        return True
+    print("[❌] Ошибка подключения к OpenAI")
+    return False
@@ -0,0 +1,234 @@
+# ai_governor.py - Global OpenAI concurrency governor
+"""
+Общий регулятор запросов к OpenAI
+
+- token bucket на запросы в минуту (RPM) и токены в минуту (TPM);
+  стоимость запроса в токенах оценивается по промпту и max_tokens,
+  после ответа корректируется по response.usage;
+- ограничение одновременных запросов;
+- очередь с приоритетами: пользователь, завершающий бросок, обслуживается
+  раньше нового броска, спекулятивные запросы — в последнюю очередь;
+- ограниченное ожидание: не дождались слота за AI_QUEUE_TIMEOUT — QueueTimeout
+  (генераторы отдают fallback), при постановке в очередь вызывается on_queued;
+- повышение приоритета: запрос с меткой tag, который ещё ждёт в очереди,
+  можно поднять (promote) — например, спекулятивный запрос, результат
+  которого уже ждёт пользователь.
+"""
+
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional
+
+from config import AI_RPM_LIMIT, AI_TPM_LIMIT, AI_MAX_CONCURRENCY, AI_QUEUE_TIMEOUT
+
+# Приоритеты (меньше — важнее)
+PRIORITY_FLOW_END = 0      # вопросы для рефлексии — пользователь завершает бросок
+PRIORITY_FOLLOW_UP = 1     # пути после интерпретации
+PRIORITY_NEW_THROW = 2     # интерпретация нового броска
+PRIORITY_SPECULATIVE = 3   # фоновые спекулятивные запросы
+
+# Грубая оценка: символов на токен (кириллица дороже латиницы)
+CHARS_PER_TOKEN = 2.5
+# Служебные токены на каждое сообщение чата
+TOKENS_PER_MESSAGE = 4
+
+
+class QueueTimeout(Exception):
+    """Слот для запроса не освободился за отведённое время"""
+
+
+def estimate_tokens(messages: List[Dict[str, str]], max_tokens: int) -> int:
+    """Оценить стоимость запроса в токенах: промпт + максимум ответа"""
+    prompt_chars = sum(len(m.get("content") or "") for m in messages)
+    return int(prompt_chars / CHARS_PER_TOKEN) + TOKENS_PER_MESSAGE * len(messages) + max_tokens
+
+
+class TokenBucket:
+    """Token bucket с пополнением per_minute единиц в минуту (0 — без ограничения)"""
+
+    def __init__(self, per_minute: int):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.tokens = float(per_minute)
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, cost: int) -> float:
+        """Сколько секунд ждать, пока в ведре наберётся cost"""
+        if not self.capacity:
+            return 0.0
+        self._refill()
+        # Запрос дороже всего ведра ждёт полного ведра, а не вечно
+        cost = min(cost, self.capacity)
+        if self.tokens >= cost:
+            return 0.0
+        return (cost - self.tokens) / self.rate
+
+    def take(self, cost: int):
+        if self.capacity:
+            self._refill()
+            self.tokens -= min(cost, self.capacity)
+
+    def adjust(self, delta: int):
+        """Поправка после факта: delta > 0 — потратили больше оценки"""
+        if self.capacity:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens - delta)
+
+
+class Ticket:
+    """Выданный слот; settle() сообщает фактический расход токенов"""
+
+    def __init__(self, governor: "Governor", estimated_tokens: int, tag: Hashable = None):
+        self.governor = governor
+        self.estimated_tokens = estimated_tokens
+        self.tag = tag
+        self.queued = False
+        self.wait_time = 0.0
+
+    def settle(self, actual_tokens: int):
+        self.governor.tpm.adjust(actual_tokens - self.estimated_tokens)
+        self.estimated_tokens = actual_tokens
+
+
+class Governor:
+    """Очередь с приоритетами поверх RPM/TPM token bucket и лимита параллельности"""
+
+    def __init__(self, rpm: int, tpm: int, max_concurrency: int, max_wait: float):
+        self.rpm = TokenBucket(rpm)
+        self.tpm = TokenBucket(tpm)
+        self.max_concurrency = max_concurrency
+        self.max_wait = max_wait
+
+        self.active = 0
+        self._heap = []
+        self._seq = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._notices = set()
+
+        self.counters = {"granted": 0, "queued": 0, "timeouts": 0}
+
+    @property
+    def queue_size(self) -> int:
+        return sum(1 for *_, future, _ in self._heap if not future.done())
+
+    @asynccontextmanager
+    async def slot(
+        self,
+        priority: int,
+        estimated_tokens: int,
+        on_queued: Optional[Callable[[], Awaitable]] = None,
+        tag: Hashable = None
+    ):
+        """Занять слот на время запроса (включая чтение стрима)"""
+        ticket = await self.acquire(priority, estimated_tokens, on_queued, tag)
+        try:
+            yield ticket
+        finally:
+            self.release()
+
+    async def acquire(
+        self,
+        priority: int,
+        estimated_tokens: int,
+        on_queued: Optional[Callable[[], Awaitable]] = None,
+        tag: Hashable = None
+    ) -> Ticket:
+        ticket = Ticket(self, estimated_tokens, tag)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        heapq.heappush(self._heap, (priority, next(self._seq), future, ticket))
+        self._pump()
+
+        if future.done():
+            return future.result()
+
+        ticket.queued = True
+        self.counters["queued"] += 1
+        if on_queued is not None:
+            notice = asyncio.ensure_future(on_queued())
+            self._notices.add(notice)
+            notice.add_done_callback(self._notices.discard)
+
+        started = loop.time()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.max_wait or None)
+        except asyncio.TimeoutError:
+            if future.done() and not future.cancelled():
+                # Слот выдан в последний момент — забираем его
+                return future.result()
+            future.cancel()
+            self.counters["timeouts"] += 1
+            raise QueueTimeout(f"no OpenAI slot within {self.max_wait}s")
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release()
+            else:
+                future.cancel()
+            raise
+
+        ticket.wait_time = loop.time() - started
+        return future.result()
+
+    def release(self):
+        self.active -= 1
+        self._pump()
+
+    def promote(self, tag: Hashable, priority: int) -> int:
+        """Поднять до priority ожидающие запросы с меткой tag. Возвращает их число"""
+        promoted = 0
+        for index, (current, seq, future, ticket) in enumerate(self._heap):
+            if ticket.tag == tag and current > priority and not future.done():
+                # seq прежний: среди равных по приоритету запрос не теряет место
+                self._heap[index] = (priority, seq, future, ticket)
+                promoted += 1
+        if promoted:
+            heapq.heapify(self._heap)
+            self._pump()
+        return promoted
+
+    def _pump(self):
+        """Выдать слоты ожидающим в порядке приоритета, пока позволяют лимиты"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        while self._heap:
+            _, _, future, ticket = self._heap[0]
+            if future.done():
+                heapq.heappop(self._heap)
+                continue
+
+            if self.max_concurrency and self.active >= self.max_concurrency:
+                return
+
+            wait = max(self.rpm.wait_time(1), self.tpm.wait_time(ticket.estimated_tokens))
+            if wait > 0:
+                self._timer = asyncio.get_running_loop().call_later(wait, self._pump)
+                return
+
+            heapq.heappop(self._heap)
+            self.rpm.take(1)
+            self.tpm.take(ticket.estimated_tokens)
+            self.active += 1
+            self.counters["granted"] += 1
+            future.set_result(ticket)
+
+    def stats(self) -> Dict[str, int]:
+        return {"active": self.active, "queue": self.queue_size, **self.counters}
+
+
+# Общий регулятор для всех генераторов ai_client
+governor = Governor(
+    rpm=AI_RPM_LIMIT,
+    tpm=AI_TPM_LIMIT,
+    max_concurrency=AI_MAX_CONCURRENCY,
+    max_wait=AI_QUEUE_TIMEOUT
+)
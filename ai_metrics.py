@@ -0,0 +1,187 @@
+# ai_metrics.py - In-process telemetry for AI calls
+"""
+Телеметрия вызовов ИИ: задержки, токены, стоимость, fallback и кэш
+
+Всё агрегируется в памяти процесса (с момента запуска):
+- гистограммы длительности генераторов, задержки API, ожидания в очереди
+  и времени до первого токена (стрим);
+- счётчики вызовов, попаданий в кэш, fallback, повторов;
+- токены prompt/completion и оценка стоимости по модели.
+
+Отдаётся в формате Prometheus (/metrics) и сводкой для админской /stats.
+"""
+
+import bisect
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+# Границы корзин гистограмм задержек (сек)
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 1.5, 2, 3, 5, 8, 13, 20, 30)
+
+# Цена за 1M токенов (USD): (prompt, completion). Ищется по префиксу имени модели
+MODEL_PRICES = {
+    "gpt-3.5-turbo": (0.50, 1.50),
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4.1": (2.00, 8.00),
+}
+
+
+def model_price(model: str) -> Optional[Tuple[float, float]]:
+    """Цена модели по самому длинному совпадающему префиксу"""
+    matches = [name for name in MODEL_PRICES if model.startswith(name)]
+    if not matches:
+        return None
+    return MODEL_PRICES[max(matches, key=len)]
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами (кумулятивная, как в Prometheus)"""
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # последняя — +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Оценка квантиля линейной интерполяцией внутри корзины"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            if seen + bucket_count >= rank and bucket_count:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.buckets[-1]
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        result, total = [], 0
+        for bound, bucket_count in zip(list(self.buckets) + ["+Inf"], self.counts):
+            total += bucket_count
+            result.append((str(bound), total))
+        return result
+
+
+class AIMetrics:
+    """Агрегатор телеметрии по генераторам и типам вызовов"""
+
+    def __init__(self):
+        # generator -> гистограмма полной длительности (кэш, очередь, повторы, fallback)
+        self.durations: Dict[str, Histogram] = defaultdict(Histogram)
+        # kind -> гистограмма задержки одного запроса к API
+        self.api_latency: Dict[str, Histogram] = defaultdict(Histogram)
+        self.queue_wait: Dict[str, Histogram] = defaultdict(Histogram)
+        self.first_token: Dict[str, Histogram] = defaultdict(Histogram)
+
+        # (метрика, generator) -> значение
+        self.counters: Dict[Tuple[str, str], float] = defaultdict(float)
+        # (model, "prompt"/"completion") -> токены
+        self.tokens: Dict[Tuple[str, str], int] = defaultdict(int)
+        self.cost_usd = 0.0
+
+    # ---------- запись ----------
+
+    def record_generation(self, generator: str, seconds: float):
+        self.durations[generator].observe(seconds)
+        self.counters[("calls", generator)] += 1
+
+    def record_cache_hit(self, generator: str):
+        self.counters[("cache_hits", generator)] += 1
+
+    def record_fallback(self, generator: str):
+        self.counters[("fallbacks", generator)] += 1
+
+    def record_retry(self, kind: str):
+        self.counters[("retries", kind)] += 1
+
+    def record_first_token(self, kind: str, seconds: float):
+        self.first_token[kind].observe(seconds)
+
+    def record_completion(self, kind: str, model: str, seconds: float, usage=None, queue_wait: float = 0.0):
+        """Один успешный запрос к API: задержка, ожидание слота, usage и стоимость"""
+        self.api_latency[kind].observe(seconds)
+        self.queue_wait[kind].observe(queue_wait)
+        self.counters[("requests", kind)] += 1
+
+        if usage is None:
+            return
+        prompt_tokens = usage.prompt_tokens or 0
+        completion_tokens = usage.completion_tokens or 0
+        self.tokens[(model, "prompt")] += prompt_tokens
+        self.tokens[(model, "completion")] += completion_tokens
+
+        price = model_price(model)
+        if price:
+            self.cost_usd += (prompt_tokens * price[0] + completion_tokens * price[1]) / 1_000_000
+
+    # ---------- чтение ----------
+
+    def summary(self) -> Dict:
+        """Сводка по генераторам для /stats"""
+        generators = {}
+        for generator, histogram in sorted(self.durations.items()):
+            calls = self.counters.get(("calls", generator), 0)
+            generators[generator] = {
+                "calls": int(calls),
+                "p50": histogram.quantile(0.5),
+                "p99": histogram.quantile(0.99),
+                "fallback_rate": round(self.counters.get(("fallbacks", generator), 0) / calls * 100, 1) if calls else 0,
+                "cache_hit_rate": round(self.counters.get(("cache_hits", generator), 0) / calls * 100, 1) if calls else 0,
+            }
+
+        return {
+            "generators": generators,
+            "prompt_tokens": sum(v for (_, part), v in self.tokens.items() if part == "prompt"),
+            "completion_tokens": sum(v for (_, part), v in self.tokens.items() if part == "completion"),
+            "cost_usd": round(self.cost_usd, 4),
+            "retries": int(sum(v for (name, _), v in self.counters.items() if name == "retries")),
+        }
+
+    def render_prometheus(self, gauges: Optional[Dict[str, float]] = None) -> str:
+        """Метрики в текстовом формате Prometheus"""
+        lines = []
+
+        def histogram_lines(name: str, label: str, histograms: Dict[str, Histogram], help_text: str):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            for key, histogram in sorted(histograms.items()):
+                for bound, total in histogram.cumulative():
+                    lines.append(f'{name}_bucket{{{label}="{key}",le="{bound}"}} {total}')
+                lines.append(f'{name}_sum{{{label}="{key}"}} {histogram.sum:.6f}')
+                lines.append(f'{name}_count{{{label}="{key}"}} {histogram.count}')
+
+        histogram_lines("ai_generation_seconds", "generator", self.durations, "Full generator duration")
+        histogram_lines("ai_request_seconds", "kind", self.api_latency, "Single OpenAI request latency")
+        histogram_lines("ai_queue_wait_seconds", "kind", self.queue_wait, "Wait for an ai_governor slot")
+        histogram_lines("ai_first_token_seconds", "kind", self.first_token, "Time to first streamed token")
+
+        lines.append("# TYPE ai_events_total counter")
+        for (name, key), value in sorted(self.counters.items()):
+            lines.append(f'ai_events_total{{event="{name}",generator="{key}"}} {int(value)}')
+
+        lines.append("# TYPE ai_tokens_total counter")
+        for (model, part), value in sorted(self.tokens.items()):
+            lines.append(f'ai_tokens_total{{model="{model}",type="{part}"}} {value}')
+
+        lines.append("# TYPE ai_cost_usd_total counter")
+        lines.append(f"ai_cost_usd_total {self.cost_usd:.6f}")
+
+        for name, value in sorted((gauges or {}).items()):
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+# Общий экземпляр телеметрии процесса
+metrics = AIMetrics()
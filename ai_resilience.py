@@ -0,0 +1,272 @@
+# ai_resilience.py - Deadlines, retries, hedging and circuit breaker for OpenAI calls
+"""
+Устойчивость вызовов OpenAI
+
+- дедлайн на весь вызов (включая повторы); отсчёт идёт с момента, когда
+  регулятор выдал слот, — ожидание в локальной очереди не считается ни
+  в дедлайн, ни сбоем провайдера (его ограничивает AI_QUEUE_TIMEOUT);
+- повторы с экспоненциальной задержкой и jitter только для 429/5xx
+  (учитывается заголовок Retry-After);
+- hedging (опционально): если ответа нет дольше p95 задержки, параллельно
+  отправляется дубликат запроса, побеждает первый ответ;
+- circuit breaker: после серии сбоев провайдера вызовы сразу падают
+  в fallback, пока не пройдёт AI_BREAKER_RESET_TIMEOUT.
+"""
+
+import asyncio
+import contextlib
+import random
+import time
+from collections import Counter, deque
+from typing import AsyncContextManager, Awaitable, Callable, Dict, Optional, TypeVar
+
+from openai import APIConnectionError, APIStatusError, APITimeoutError
+
+from ai_metrics import metrics
+
+from config import (
+    AI_CALL_DEADLINE, AI_MAX_RETRIES, AI_RETRY_BASE_DELAY,
+    AI_HEDGING, AI_HEDGE_MIN_DELAY,
+    AI_BREAKER_FAILURE_THRESHOLD, AI_BREAKER_RESET_TIMEOUT
+)
+
+T = TypeVar("T")
+
+# Сколько последних задержек хранить для оценки p95
+LATENCY_WINDOW = 200
+# Минимум замеров, после которого p95 используется как задержка hedge
+MIN_LATENCY_SAMPLES = 20
+
+
+class CircuitOpenError(Exception):
+    """Провайдер признан нездоровым — вызов не выполняется"""
+
+
+def is_retryable(error: Exception) -> bool:
+    """Повторяем только 429 и 5xx"""
+    return isinstance(error, APIStatusError) and (error.status_code == 429 or error.status_code >= 500)
+
+
+def is_provider_failure(error: Exception) -> bool:
+    """Сбой на стороне провайдера/сети (считается в circuit breaker)"""
+    return (
+        is_retryable(error)
+        or isinstance(error, (APITimeoutError, APIConnectionError, asyncio.TimeoutError))
+    )
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    """Значение заголовка Retry-After (сек), если провайдер его прислал"""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class CircuitBreaker:
+    """Closed → open после failure_threshold сбоев подряд → half-open через reset_timeout"""
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probe_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self):
+        """Пропустить вызов или бросить CircuitOpenError"""
+        if not self.failure_threshold:
+            return
+        state = self.state
+        if state == "open":
+            raise CircuitOpenError("OpenAI circuit is open")
+        if state == "half_open":
+            # Пропускаем один пробный вызов
+            if self._probe_in_flight:
+                raise CircuitOpenError("OpenAI circuit is half-open, probe in flight")
+            self._probe_in_flight = True
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._probe_in_flight = False
+        if self.opened_at is not None or (self.failure_threshold and self.failures >= self.failure_threshold):
+            if self.opened_at is None:
+                print(f"[🔌] OpenAI circuit breaker открыт после {self.failures} сбоев")
+            self.opened_at = time.monotonic()
+
+    def release_probe(self):
+        """Пробный вызов завершился не по вине провайдера"""
+        self._probe_in_flight = False
+
+
+class LatencyTracker:
+    """Скользящее окно задержек успешных вызовов по типам для p95"""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self.window = window
+        self._samples: Dict[str, deque] = {}
+
+    def add(self, kind: str, seconds: float):
+        self._samples.setdefault(kind, deque(maxlen=self.window)).append(seconds)
+
+    def p95(self, kind: str) -> Optional[float]:
+        samples = self._samples.get(kind)
+        if not samples or len(samples) < MIN_LATENCY_SAMPLES:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+
+breaker = CircuitBreaker(AI_BREAKER_FAILURE_THRESHOLD, AI_BREAKER_RESET_TIMEOUT)
+latencies = LatencyTracker()
+counters: Counter = Counter()
+
+
+async def _hedged(kind: str, attempt: Callable[..., Awaitable[T]]) -> T:
+    """
+    Первый запрос; если он дольше p95 — дубликат, берём первый успешный ответ
+
+    attempt(granted) отмечает в future granted момент выдачи слота. Задержка
+    hedge отсчитывается от него: пока первый запрос ждёт в локальной очереди,
+    дубликат только удвоил бы очередь. Дубликат — attempt(duplicate=True).
+    """
+    delay = max(AI_HEDGE_MIN_DELAY, latencies.p95(kind) or 0)
+    granted = asyncio.get_running_loop().create_future()
+    primary = asyncio.ensure_future(attempt(granted))
+    tasks = {primary}
+    try:
+        await asyncio.wait({primary, granted}, return_when=asyncio.FIRST_COMPLETED)
+        done = {primary} if primary.done() else (await asyncio.wait(tasks, timeout=delay))[0]
+        if not done:
+            counters["hedges"] += 1
+            tasks.add(asyncio.ensure_future(attempt(duplicate=True)))
+
+        error = None
+        while tasks:
+            done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is not primary:
+                        counters["hedge_wins"] += 1
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        granted.cancel()
+        for task in tasks:
+            task.cancel()
+            task.add_done_callback(_discard_outcome)
+
+
+def _discard_outcome(task: asyncio.Task):
+    """Отменённая попытка могла успеть завершиться ошибкой своего дедлайна"""
+    if not task.cancelled():
+        task.exception()
+
+
+async def call_with_resilience(
+    kind: str,
+    attempt: Callable[[], Awaitable[T]],
+    deadline: float = AI_CALL_DEADLINE,
+    hedge: bool = AI_HEDGING,
+    slot: Optional[Callable[[bool], AsyncContextManager]] = None
+) -> T:
+    """
+    Выполнить вызов OpenAI с дедлайном, повторами, hedging и circuit breaker
+
+    Args:
+        kind: тип вызова (для p95 задержек)
+        attempt: фабрика одной попытки (каждый вызов — новый запрос);
+            если задан slot, получает выданный слот аргументом
+        deadline: общий дедлайн в секундах, включая повторы (0 — без дедлайна)
+        hedge: разрешить дублирующий запрос после p95 задержки
+        slot: фабрика слота регулятора на одну попытку, slot(duplicate) —
+            duplicate=True для дубликата hedge; дедлайн начинается с первого
+            выданного слота, ожидание в очереди в него не входит
+
+    Raises:
+        CircuitOpenError: провайдер нездоров, вызов не выполнялся
+        Исключение последней попытки или TimeoutError по дедлайну
+    """
+    try:
+        breaker.allow()
+    except CircuitOpenError:
+        counters["breaker_rejections"] += 1
+        raise
+
+    loop = asyncio.get_running_loop()
+    deadline_at = None
+    retries = 0
+
+    def start_deadline() -> Optional[float]:
+        nonlocal deadline_at
+        if deadline and deadline_at is None:
+            deadline_at = loop.time() + deadline
+        return deadline_at
+
+    async def timed_attempt(granted: Optional[asyncio.Future] = None, duplicate: bool = False):
+        # Дедлайн, задержка hedge и замер p95 — с выдачи слота: локальная
+        # очередь не выдаётся за медленного провайдера
+        async with (slot(duplicate) if slot is not None else contextlib.nullcontext()) as ticket:
+            started = loop.time()
+            if granted is not None and not granted.done():
+                granted.set_result(started)
+            async with asyncio.timeout_at(start_deadline()):
+                result = await (attempt(ticket) if slot is not None else attempt())
+            latencies.add(kind, loop.time() - started)
+            return result
+
+    while True:
+        try:
+            result = await (_hedged(kind, timed_attempt) if hedge else timed_attempt())
+        except asyncio.CancelledError:
+            breaker.release_probe()
+            raise
+        except Exception as e:
+            if isinstance(e, TimeoutError):
+                counters["deadline_exceeded"] += 1
+
+            if is_retryable(e) and retries < AI_MAX_RETRIES:
+                # Экспоненциальная задержка с full jitter, не меньше Retry-After
+                delay = random.uniform(0, AI_RETRY_BASE_DELAY * 2 ** retries)
+                delay = max(delay, _retry_after(e) or 0)
+                if deadline_at is None or loop.time() + delay < deadline_at:
+                    retries += 1
+                    counters["retries"] += 1
+                    metrics.record_retry(kind)
+                    await asyncio.sleep(delay)
+                    continue
+
+            if is_provider_failure(e):
+                breaker.record_failure()
+            else:
+                breaker.release_probe()
+            raise
+
+        breaker.record_success()
+        return result
+
+
+def stats() -> Dict:
+    """Состояние breaker, p95 и счётчики повторов/hedge"""
+    return {
+        "breaker": breaker.state,
+        "consecutive_failures": breaker.failures,
+        **dict(counters)
+    }
@@ -0,0 +1,388 @@
+# analytics_engine.py - Vectorized symbol and path analytics
+"""
+Аналитика символов и путей на NumPy
+
+Броски загружаются из базы одним столбцом целых: упакованный расклад
+(dice_throws.layout, см. symbol_registry) плюс код выбранного пути в старших
+битах. Дальше всё считается операциями над массивами, без цикла по строкам:
+
+- частоты символов по позициям (6 × 16);
+- матрица совместной встречаемости символов в броске (16 × 16) —
+  по всем броскам и по брошенным (путь не выбран);
+- распределение путей при условии «символ X на позиции Y» (6 × 16 × пути).
+
+Миллионы бросков загружаются и считаются за секунды; память — несколько
+байт на бросок. Броски без layout (старые, из трёх символов) не учитываются.
+
+Там же — матрица удержания по когортам первого броска (CohortRetention):
+она кэшируется в процессе и досчитывается по новым броскам.
+"""
+
+import asyncio
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import List, Optional
+
+import numpy as np
+from sqlalchemy import Integer, case, cast, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import DiceThrow
+from dice_meanings import DICE_POSITIONS, STORY_PATHS
+from symbol_registry import LAYOUT_BITS, LAYOUT_POSITIONS, SYMBOL_ORDER
+
+# Пути в порядке кодов 1..N; 0 — бросок брошен (путь не выбран)
+PATH_KEYS = list(STORY_PATHS)
+POSITION_KEYS = list(DICE_POSITIONS)
+N_SYMBOLS = len(SYMBOL_ORDER)
+
+# Сдвиг кода пути над упакованным раскладом
+_PATH_SHIFT = LAYOUT_BITS * LAYOUT_POSITIONS
+_SYMBOL_MASK = (1 << LAYOUT_BITS) - 1
+
+# Строк за одну выборку с курсора
+LOAD_CHUNK_SIZE = 50000
+# Бросков за один проход матричного умножения (ограничивает память)
+COMPUTE_CHUNK_SIZE = 1 << 18
+
+
+# ===================================
+# LOADING
+# ===================================
+
+async def load_throw_codes(session: AsyncSession) -> np.ndarray:
+    """
+    Все упакованные броски одним массивом int64: layout | код пути << 24
+
+    Код пути считается в SQL (CASE), поэтому из базы приходит одно целое
+    на строку. Пути, которых нет в STORY_PATHS, получают код N + 1
+    и в распределения путей не попадают.
+    """
+    path_code = case(
+        *[(DiceThrow.chosen_path == key, index + 1) for index, key in enumerate(PATH_KEYS)],
+        (DiceThrow.chosen_path.is_(None), 0),
+        else_=len(PATH_KEYS) + 1
+    )
+    statement = (
+        select(DiceThrow.layout + path_code * (1 << _PATH_SHIFT))
+        .where(DiceThrow.layout.isnot(None))
+    )
+
+    return (await _fetch_int_columns(session, statement, 1))[:, 0]
+
+
+async def _fetch_int_columns(session: AsyncSession, statement, width: int) -> np.ndarray:
+    """Целочисленные столбцы запроса одним массивом int64 [строка, столбец]"""
+    chunks = []
+    connection = await session.connection()
+    if connection.dialect.name == "sqlite":
+        # Обработка строк в SQLAlchemy дороже самого чтения: на SQLite берём
+        # курсор aiosqlite того же соединения (в той же транзакции) напрямую
+        sql = str(statement.compile(dialect=connection.dialect, compile_kwargs={"literal_binds": True}))
+        raw = await connection.get_raw_connection()
+        cursor = await raw.driver_connection.execute(sql)
+        try:
+            while True:
+                rows = await cursor.fetchmany(LOAD_CHUNK_SIZE)
+                if not rows:
+                    break
+                chunks.append(np.array(rows, dtype=np.int64).reshape(-1, width))
+        finally:
+            await cursor.close()
+    else:
+        result = await session.stream(statement.execution_options(yield_per=LOAD_CHUNK_SIZE))
+        async for chunk in result.partitions():
+            chunks.append(np.array([tuple(row) for row in chunk], dtype=np.int64).reshape(-1, width))
+    return np.concatenate(chunks) if chunks else np.zeros((0, width), dtype=np.int64)
+
+
+# ===================================
+# COMPUTATION
+# ===================================
+
+@dataclass
+class SymbolAnalytics:
+    """Результаты по всем загруженным броскам"""
+    total: int
+    # [позиция, символ] — сколько раз символ выпал на позиции
+    position_symbol: np.ndarray
+    # [a, b] — в скольких бросках есть оба символа (диагональ — броски с символом)
+    cooccurrence: np.ndarray
+    # То же по брошенным броскам
+    cooccurrence_abandoned: np.ndarray
+    # [позиция, символ, код пути] — 0 брошен, 1..N пути PATH_KEYS
+    path_counts: np.ndarray
+
+    def path_distribution(self) -> np.ndarray:
+        """Доля каждого пути среди завершённых бросков (N)"""
+        totals = self.path_counts[0].sum(axis=0)[1:len(PATH_KEYS) + 1]
+        return totals / max(totals.sum(), 1)
+
+    def path_probabilities(self) -> np.ndarray:
+        """P(путь | символ на позиции) среди завершённых: [позиция, символ, путь]"""
+        completed = self.path_counts[:, :, 1:len(PATH_KEYS) + 1].astype(np.float64)
+        support = completed.sum(axis=2, keepdims=True)
+        return np.divide(completed, support, out=np.zeros_like(completed), where=support > 0)
+
+    def abandon_rate(self) -> np.ndarray:
+        """Доля брошенных бросков при символе на позиции: [позиция, символ]"""
+        counts = self.path_counts.sum(axis=2).astype(np.float64)
+        return np.divide(self.path_counts[:, :, 0], counts, out=np.zeros_like(counts), where=counts > 0)
+
+    def top_path_correlations(self, limit: int = 10, min_support: int = 30) -> List[dict]:
+        """
+        Сочетания «позиция, символ → путь» с наибольшим подъёмом (lift):
+        во сколько раз путь выбирают чаще, чем в среднем
+        """
+        probabilities = self.path_probabilities()
+        baseline = self.path_distribution()
+        support = self.path_counts[:, :, 1:len(PATH_KEYS) + 1].sum(axis=2)
+        lift = np.divide(
+            probabilities, baseline, out=np.zeros_like(probabilities), where=baseline > 0
+        )
+        lift[support < min_support] = 0
+
+        order = np.argsort(lift, axis=None)[::-1][:limit]
+        rows = []
+        for position, symbol, path in zip(*np.unravel_index(order, lift.shape)):
+            if lift[position, symbol, path] <= 0:
+                break
+            rows.append({
+                "position": POSITION_KEYS[position],
+                "symbol": SYMBOL_ORDER[symbol],
+                "path": PATH_KEYS[path],
+                "probability": float(probabilities[position, symbol, path]),
+                "lift": float(lift[position, symbol, path]),
+                "support": int(support[position, symbol]),
+            })
+        return rows
+
+    def top_abandoned_pairs(self, limit: int = 10, min_support: int = 30) -> List[dict]:
+        """Пары символов, с которыми бросок чаще всего бросают (доля брошенных)"""
+        together = self.cooccurrence.astype(np.float64)
+        rate = np.divide(
+            self.cooccurrence_abandoned, together, out=np.zeros_like(together), where=together > 0
+        )
+        # Только разные символы, каждая пара один раз
+        rate[np.tril_indices(N_SYMBOLS)] = 0
+        rate[self.cooccurrence < min_support] = 0
+
+        order = np.argsort(rate, axis=None)[::-1][:limit]
+        rows = []
+        for a, b in zip(*np.unravel_index(order, rate.shape)):
+            if rate[a, b] <= 0:
+                break
+            rows.append({
+                "symbols": (SYMBOL_ORDER[a], SYMBOL_ORDER[b]),
+                "abandon_rate": float(rate[a, b]),
+                "support": int(self.cooccurrence[a, b]),
+            })
+        return rows
+
+
+def decode_symbols(codes: np.ndarray) -> np.ndarray:
+    """Символы по позициям из упакованных бросков: [бросок, позиция] uint8"""
+    shifts = np.arange(LAYOUT_POSITIONS, dtype=np.int64) * LAYOUT_BITS
+    return ((codes[:, None] >> shifts) & _SYMBOL_MASK).astype(np.uint8)
+
+
+def compute_symbol_analytics(codes: np.ndarray) -> SymbolAnalytics:
+    """Все таблицы за один проход по массиву бросков (кусками по COMPUTE_CHUNK_SIZE)"""
+    n_codes = len(PATH_KEYS) + 2  # брошен, пути, неизвестный путь
+    position_offsets = np.arange(LAYOUT_POSITIONS, dtype=np.int64) * N_SYMBOLS
+
+    position_symbol = np.zeros(LAYOUT_POSITIONS * N_SYMBOLS, dtype=np.int64)
+    path_counts = np.zeros(LAYOUT_POSITIONS * N_SYMBOLS * n_codes, dtype=np.int64)
+    cooccurrence = np.zeros((N_SYMBOLS, N_SYMBOLS), dtype=np.int64)
+    cooccurrence_abandoned = np.zeros((N_SYMBOLS, N_SYMBOLS), dtype=np.int64)
+
+    for start in range(0, len(codes), COMPUTE_CHUNK_SIZE):
+        chunk = codes[start:start + COMPUTE_CHUNK_SIZE]
+        symbols = decode_symbols(chunk)
+        paths = (chunk >> _PATH_SHIFT).astype(np.int64)
+
+        # Частоты: индекс позиция * 16 + символ
+        cells = symbols + position_offsets
+        position_symbol += np.bincount(cells.ravel(), minlength=position_symbol.size)
+
+        # Пути: индекс (позиция * 16 + символ) * коды + код пути
+        path_cells = cells * n_codes + paths[:, None]
+        path_counts += np.bincount(path_cells.ravel(), minlength=path_counts.size)
+
+        # Присутствие символов в броске (повтор символа считается один раз)
+        presence = np.zeros((len(chunk), N_SYMBOLS), dtype=np.float32)
+        presence[np.arange(len(chunk))[:, None], symbols] = 1
+        cooccurrence += (presence.T @ presence).astype(np.int64)
+        abandoned = presence[paths == 0]
+        cooccurrence_abandoned += (abandoned.T @ abandoned).astype(np.int64)
+
+    return SymbolAnalytics(
+        total=len(codes),
+        position_symbol=position_symbol.reshape(LAYOUT_POSITIONS, N_SYMBOLS),
+        cooccurrence=cooccurrence,
+        cooccurrence_abandoned=cooccurrence_abandoned,
+        path_counts=path_counts.reshape(LAYOUT_POSITIONS, N_SYMBOLS, n_codes),
+    )
+
+
+async def get_symbol_analytics(session: AsyncSession) -> SymbolAnalytics:
+    """Загрузить броски и посчитать аналитику символов (счёт — вне event loop)"""
+    codes = await load_throw_codes(session)
+    return await asyncio.get_running_loop().run_in_executor(None, compute_symbol_analytics, codes)
+
+
+
+# ===================================
+# COHORT RETENTION
+# ===================================
+
+# Размер периода в днях: когорты по дню и по неделе (с понедельника)
+RETENTION_GRANULARITIES = {"day": 1, "week": 7}
+# Сколько последних бросков перечитывать при обновлении: строка с меньшим id
+# могла закоммититься позже уже прочитанной. Повторный учёт ничего не меняет
+RETENTION_REREAD_ROWS = 1000
+
+_EPOCH = date(1970, 1, 1)
+# 1970-01-01 — четверг: сдвиг, чтобы недели начинались с понедельника
+_WEEK_SHIFT = 3
+# Пара (пользователь, период) кодируется одним целым: период в младших битах
+_PERIOD_BITS = 20
+
+
+def _epoch_day(column, dialect_name: str):
+    """SQL: номер дня от 1970-01-01 для столбца DateTime"""
+    if dialect_name == "postgresql":
+        return cast(func.floor(func.extract("epoch", column) / 86400), Integer)
+    return cast(func.julianday(column) - 2440587.5, Integer)
+
+
+def _grow(array: np.ndarray, size: int) -> np.ndarray:
+    """Массив по users.id длиной не меньше size, новые ячейки — -1"""
+    if size <= len(array):
+        return array
+    grown = np.full(max(size, len(array) * 2), -1, dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+
+class _RetentionMatrix:
+    """Счётчики одной гранулярности: [когорта, период] -> активных пользователей"""
+
+    def __init__(self, period_days: int):
+        self.period_days = period_days
+        self.shift = _WEEK_SHIFT if period_days == 7 else 0
+        self.origin: Optional[int] = None  # номер периода первой когорты
+        self.counts = np.zeros((0, 0), dtype=np.int64)
+        # Последний учтённый период активности по users.id (-1 — ещё не было)
+        self.last_period = np.zeros(0, dtype=np.int32)
+
+    def bucket(self, days):
+        return (days + self.shift) // self.period_days
+
+    def add(self, users: np.ndarray, days: np.ndarray, cohort_day: np.ndarray):
+        cohorts = self.bucket(cohort_day[users])
+        # Бросок, закоммиченный позже первого учтённого, не уходит в минус
+        periods = np.maximum(self.bucket(days) - cohorts, 0)
+
+        # Уникальные пары (пользователь, период) новее уже учтённых
+        keys = np.unique((users << _PERIOD_BITS) | periods)
+        pair_users = keys >> _PERIOD_BITS
+        pair_periods = keys & ((1 << _PERIOD_BITS) - 1)
+        self.last_period = _grow(self.last_period, int(users.max()) + 1)
+        fresh = pair_periods > self.last_period[pair_users]
+        pair_users, pair_periods = pair_users[fresh], pair_periods[fresh]
+        if not len(pair_users):
+            return
+        np.maximum.at(self.last_period, pair_users, pair_periods.astype(np.int32))
+
+        pair_cohorts = self.bucket(cohort_day[pair_users])
+        if self.origin is None:
+            self.origin = int(pair_cohorts.min())
+        rows = pair_cohorts - self.origin
+        shape = (
+            max(self.counts.shape[0], int(rows.max()) + 1),
+            max(self.counts.shape[1], int(pair_periods.max()) + 1)
+        )
+        if shape != self.counts.shape:
+            grown = np.zeros(shape, dtype=np.int64)
+            grown[:self.counts.shape[0], :self.counts.shape[1]] = self.counts
+            self.counts = grown
+        np.add.at(self.counts, (rows, pair_periods), 1)
+
+    def table(self, today: date, limit: Optional[int]) -> List[dict]:
+        if self.origin is None:
+            return []
+        current = self.bucket((today - _EPOCH).days)
+        first = 0 if limit is None else max(0, self.counts.shape[0] - limit)
+        table = []
+        for row in range(first, self.counts.shape[0]):
+            size = int(self.counts[row, 0])
+            if size == 0:
+                continue
+            cohort = self.origin + row
+            # Периоды, которые ещё не наступили, не показываем (а не считаем нулём)
+            observed = min(current - cohort + 1, self.counts.shape[1])
+            table.append({
+                "cohort": _EPOCH + timedelta(days=cohort * self.period_days - self.shift),
+                "size": size,
+                "retention": [int(count) / size for count in self.counts[row, :max(observed, 1)]],
+            })
+        return table
+
+
+class CohortRetention:
+    """
+    Матрица удержания по когортам первого броска (по дням и по неделям)
+
+    Ячейка [когорта, k] — доля пользователей когорты, бросавших кубики
+    в k-й день / неделю после первого броска.
+
+    Результат кэшируется в памяти процесса: refresh() дочитывает только
+    броски новее последнего учтённого id и досчитывает матрицы. Первый вызов
+    проходит по таблице один раз в порядке id, дальше — только по новым
+    строкам. Пары (пользователь, период) считаются массивами NumPy.
+    """
+
+    def __init__(self):
+        self.last_id = 0
+        # День первого броска по users.id (-1 — бросков не было)
+        self.cohort_day = np.zeros(0, dtype=np.int64)
+        self.matrices = {name: _RetentionMatrix(days) for name, days in RETENTION_GRANULARITIES.items()}
+        self._lock = asyncio.Lock()
+
+    async def refresh(self, session: AsyncSession):
+        """Учесть броски, появившиеся после прошлого обновления"""
+        async with self._lock:
+            connection = await session.connection()
+            statement = (
+                select(DiceThrow.id, DiceThrow.user_id, _epoch_day(DiceThrow.timestamp, connection.dialect.name))
+                .where(DiceThrow.id > self.last_id - RETENTION_REREAD_ROWS, DiceThrow.timestamp.isnot(None))
+                .order_by(DiceThrow.id)
+            )
+            rows = await _fetch_int_columns(session, statement, 3)
+            if len(rows):
+                await asyncio.get_running_loop().run_in_executor(None, self._apply, rows)
+
+    def _apply(self, rows: np.ndarray):
+        ids, users, days = rows[:, 0], rows[:, 1], rows[:, 2]
+
+        # Когорта — день первого броска (строки идут по id, т.е. по времени)
+        self.cohort_day = _grow(self.cohort_day, int(users.max()) + 1)
+        first_users, first_rows = np.unique(users, return_index=True)
+        new_users = self.cohort_day[first_users] < 0
+        self.cohort_day[first_users[new_users]] = days[first_rows[new_users]]
+
+        for matrix in self.matrices.values():
+            matrix.add(users, days, self.cohort_day)
+        self.last_id = max(self.last_id, int(ids.max()))
+
+    def table(self, granularity: str = "week", limit: Optional[int] = 8) -> List[dict]:
+        """
+        Последние limit когорт (None — все): {"cohort": дата начала,
+        "size": размер, "retention": [доля активных в периоде 0, 1, ...]}
+        """
+        return self.matrices[granularity].table(datetime.utcnow().date(), limit)
+
+
+# Кэш процесса: /analytics и экспорт обновляют его по новым броскам
+retention = CohortRetention()
@@ -0,0 +1,296 @@
+# columnar_export.py - Incremental Parquet/Arrow export of throws and users
+"""
+Инкрементальный экспорт dice_throws и users в колоночные файлы
+
+Каждый запуск читает только строки новее сохранённой отметки (watermark)
+по ключу (timestamp, id) и дописывает их новыми файлами в разделы по дням:
+
+    analytics_export/
+        _watermark.json
+        dice_throws/day=2024-06-01/part-20240602T030000123456-1a2b3c4d.parquet
+        users/day=2024-06-01/part-20240602T030000123456-1a2b3c4d.parquet
+
+Разделы в стиле Hive: pyarrow.dataset / pandas.read_parquet(каталог)
+читают их целиком и добавляют столбец day.
+
+Бросок дописывается после вставки (интерпретация, путь, вопросы), а уже
+выгруженные строки не перечитываются. Поэтому выгружаются только строки
+старше ANALYTICS_EXPORT_SETTLE_MINUTES. users.last_interaction меняется
+постоянно и в экспорт не входит.
+
+Отметка сохраняется после того, как все файлы запуска записаны. Если
+запуск упал раньше, недописанные файлы (*.tmp) игнорируются, и следующий
+запуск выгрузит те же строки заново.
+
+pyarrow — необязательная зависимость: pip install pyarrow
+"""
+
+import json
+import os
+import time
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import select, tuple_
+
+from config import (
+    ANALYTICS_EXPORT_DIR, ANALYTICS_EXPORT_FORMAT, ANALYTICS_EXPORT_COMPRESSION,
+    ANALYTICS_EXPORT_SETTLE_MINUTES
+)
+from database import User, DiceThrow, snapshot_session
+
+# Строк за одну выборку с курсора (и одна группа строк в файле)
+EXPORT_CHUNK_SIZE = 10000
+
+WATERMARK_FILE = "_watermark.json"
+
+FILE_EXTENSIONS = {"parquet": "parquet", "arrow": "arrow"}
+
+
+@dataclass
+class ExportTable:
+    """Что и как выгружать из таблицы"""
+    name: str
+    columns: list
+    timestamp: object  # столбец ключа и разбиения по дням
+    id: object
+    schema: object  # pyarrow.Schema
+
+
+def _tables(pa) -> List[ExportTable]:
+    return [
+        ExportTable(
+            name="dice_throws",
+            columns=[
+                DiceThrow.id, DiceThrow.user_id, DiceThrow.timestamp, DiceThrow.situation,
+                DiceThrow.symbol, DiceThrow.archetype, DiceThrow.emotion,
+                DiceThrow.shadow_symbol, DiceThrow.gift_symbol, DiceThrow.step_symbol,
+                DiceThrow.layout, DiceThrow.interpretation, DiceThrow.chosen_path,
+                DiceThrow.reflection_prompts
+            ],
+            timestamp=DiceThrow.timestamp,
+            id=DiceThrow.id,
+            schema=pa.schema([
+                ("id", pa.int64()),
+                ("user_id", pa.int64()),
+                ("timestamp", pa.timestamp("us")),
+                ("situation", pa.string()),
+                ("symbol", pa.string()),
+                ("archetype", pa.string()),
+                ("emotion", pa.string()),
+                ("shadow_symbol", pa.string()),
+                ("gift_symbol", pa.string()),
+                ("step_symbol", pa.string()),
+                ("layout", pa.int32()),
+                ("interpretation", pa.string()),
+                ("chosen_path", pa.string()),
+                ("reflection_prompts", pa.string()),  # JSON array
+            ]),
+        ),
+        ExportTable(
+            name="users",
+            columns=[User.id, User.telegram_id, User.username, User.full_name, User.created_at],
+            timestamp=User.created_at,
+            id=User.id,
+            schema=pa.schema([
+                ("id", pa.int64()),
+                ("telegram_id", pa.string()),
+                ("username", pa.string()),
+                ("full_name", pa.string()),
+                ("created_at", pa.timestamp("us")),
+            ]),
+        ),
+    ]
+
+
+# ===================================
+# WATERMARK
+# ===================================
+
+def load_watermark(out_dir: str) -> Dict[str, Tuple[datetime, int]]:
+    """Отметки по таблицам: имя -> (timestamp, id) последней выгруженной строки"""
+    path = os.path.join(out_dir, WATERMARK_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        raw = json.load(f)
+    return {
+        name: (datetime.fromisoformat(mark["timestamp"]), mark["id"])
+        for name, mark in raw.items()
+    }
+
+
+def save_watermark(out_dir: str, watermark: Dict[str, Tuple[datetime, int]]):
+    """Записать отметки атомарно (через временный файл)"""
+    path = os.path.join(out_dir, WATERMARK_FILE)
+    raw = {
+        name: {"timestamp": timestamp.isoformat(), "id": row_id}
+        for name, (timestamp, row_id) in watermark.items()
+    }
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(raw, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+# ===================================
+# WRITERS
+# ===================================
+
+class _DayWriters:
+    """Открытые файлы запуска по дням; имена получают после close()"""
+
+    def __init__(self, pa, table: ExportTable, out_dir: str, run_id: str, file_format: str, compression: str):
+        self.pa = pa
+        self.table = table
+        self.out_dir = out_dir
+        self.run_id = run_id
+        self.file_format = file_format
+        self.compression = compression
+        self._writers = {}  # day -> (writer, sink, tmp_path, final_path)
+
+    def _open(self, day: str):
+        directory = os.path.join(self.out_dir, self.table.name, f"day={day}")
+        os.makedirs(directory, exist_ok=True)
+        final_path = os.path.join(directory, f"part-{self.run_id}.{FILE_EXTENSIONS[self.file_format]}")
+        tmp_path = final_path + ".tmp"
+        # Файл другого запуска не перезаписываем: его строки уже за отметкой
+        if os.path.exists(final_path):
+            raise FileExistsError(f"Файл экспорта уже существует: {final_path}")
+
+        if self.file_format == "parquet":
+            import pyarrow.parquet as pq
+            writer = pq.ParquetWriter(tmp_path, self.table.schema, compression=self.compression)
+            sink = None
+        else:
+            sink = self.pa.OSFile(tmp_path, "wb")
+            options = self.pa.ipc.IpcWriteOptions(compression=self.compression)
+            writer = self.pa.ipc.new_file(sink, self.table.schema, options=options)
+        self._writers[day] = (writer, sink, tmp_path, final_path)
+        return writer
+
+    def write(self, day: str, batch):
+        if day in self._writers:
+            writer = self._writers[day][0]
+        else:
+            writer = self._open(day)
+        writer.write_table(batch)
+
+    def close(self, commit: bool) -> List[str]:
+        """Закрыть файлы; commit=False — удалить недописанное"""
+        paths = []
+        for writer, sink, tmp_path, final_path in self._writers.values():
+            writer.close()
+            if sink is not None:
+                sink.close()
+            if commit:
+                os.replace(tmp_path, final_path)
+                paths.append(final_path)
+            else:
+                os.remove(tmp_path)
+        self._writers = {}
+        return paths
+
+
+# ===================================
+# EXPORT
+# ===================================
+
+def _to_batch(pa, table: ExportTable, rows: List):
+    """Пачка строк SQL -> pyarrow таблица по схеме"""
+    columns = list(zip(*rows))
+    arrays = [pa.array(list(values), type=field.type) for values, field in zip(columns, table.schema)]
+    return pa.Table.from_arrays(arrays, schema=table.schema)
+
+
+async def _export_table(
+    pa,
+    session,
+    table: ExportTable,
+    after: Optional[Tuple[datetime, int]],
+    until: datetime,
+    writers: _DayWriters
+) -> Tuple[int, Optional[Tuple[datetime, int]]]:
+    """Выгрузить строки таблицы в (after, until). Возвращает (число строк, новую отметку)"""
+    statement = (
+        select(*table.columns)
+        .where(table.timestamp < until)
+        .order_by(table.timestamp, table.id)
+        .execution_options(yield_per=EXPORT_CHUNK_SIZE)
+    )
+    if after is not None:
+        statement = statement.where(tuple_(table.timestamp, table.id) > tuple_(*after))
+
+    timestamp_index = table.columns.index(table.timestamp)
+    id_index = table.columns.index(table.id)
+    rows_exported = 0
+    last = after
+
+    result = await session.stream(statement)
+    async for chunk in result.partitions():
+        # Строки отсортированы по времени: пачка делится на дни по порядку
+        by_day: Dict[str, List] = {}
+        for row in chunk:
+            by_day.setdefault(row[timestamp_index].date().isoformat(), []).append(row)
+        for day, rows in by_day.items():
+            writers.write(day, _to_batch(pa, table, rows))
+
+        rows_exported += len(chunk)
+        last = (chunk[-1][timestamp_index], chunk[-1][id_index])
+
+    return rows_exported, last
+
+
+async def export_incremental(
+    out_dir: str = ANALYTICS_EXPORT_DIR,
+    file_format: str = ANALYTICS_EXPORT_FORMAT,
+    compression: str = ANALYTICS_EXPORT_COMPRESSION,
+    settle_minutes: int = ANALYTICS_EXPORT_SETTLE_MINUTES
+) -> Dict[str, int]:
+    """
+    Дописать новые строки dice_throws и users в out_dir
+
+    Возвращает число выгруженных строк по таблицам.
+    """
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise RuntimeError("Для колоночного экспорта нужен pyarrow: pip install pyarrow")
+    if file_format not in FILE_EXTENSIONS:
+        raise ValueError(f"Неизвестный формат экспорта: {file_format} (parquet / arrow)")
+
+    os.makedirs(out_dir, exist_ok=True)
+    watermark = load_watermark(out_dir)
+    until = datetime.utcnow() - timedelta(minutes=settle_minutes)
+    # Уникален и для запусков в одну секунду (перекрытие cron, повтор после сбоя)
+    run_id = f"{datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')}-{uuid.uuid4().hex[:8]}"
+
+    exported = {}
+    new_watermark = dict(watermark)
+    open_writers = []
+    try:
+        # Одна транзакция на все таблицы: броски и пользователи из одного состояния базы
+        async with snapshot_session() as session:
+            for table in _tables(pa):
+                started = time.perf_counter()
+                writers = _DayWriters(pa, table, out_dir, run_id, file_format, compression)
+                open_writers.append(writers)
+
+                rows, last = await _export_table(pa, session, table, watermark.get(table.name), until, writers)
+                exported[table.name] = rows
+                if last is not None:
+                    new_watermark[table.name] = last
+
+                elapsed = time.perf_counter() - started
+                rate = rows / elapsed if elapsed > 0 else 0
+                print(f"📦 {table.name}: {rows} новых строк за {elapsed:.2f}с ({rate:.0f} строк/с)")
+    except BaseException:
+        for writers in open_writers:
+            writers.close(commit=False)
+        raise
+
+    for writers in open_writers:
+        writers.close(commit=True)
+    save_watermark(out_dir, new_watermark)
+    return exported
@@ -17,6 +17,40 @@ if not OPENAI_API_KEY:
 # Database configuration
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///dice_bot.db")
 
+# Профиль хранилища (storage.py): настройки движка под бэкенд.
+# false — движок SQLAlchemy с настройками по умолчанию
+DB_TUNING = os.getenv("DB_TUNING", "true").lower() == "true"
+# SQLite: pragma на каждое соединение
+DB_SQLITE_WAL = os.getenv("DB_SQLITE_WAL", "true").lower() == "true"  # читатели не ждут писателя
+DB_SQLITE_SYNCHRONOUS = os.getenv("DB_SQLITE_SYNCHRONOUS", "NORMAL")  # в WAL безопасно и без fsync на коммит
+DB_SQLITE_BUSY_TIMEOUT = int(os.getenv("DB_SQLITE_BUSY_TIMEOUT", "5000"))  # мс ожидания блокировки
+DB_SQLITE_MMAP_SIZE = int(os.getenv("DB_SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))  # байт
+DB_SQLITE_CACHE_SIZE = int(os.getenv("DB_SQLITE_CACHE_SIZE", "-20000"))  # <0 — в КиБ (20 МБ)
+# Постоянные соединения к файлу SQLite (по умолчанию aiosqlite открывает новое на каждую сессию).
+# Писатель всё равно один: больше соединений — больше ожиданий блокировки
+DB_SQLITE_POOL_SIZE = int(os.getenv("DB_SQLITE_POOL_SIZE", "4"))
+# PostgreSQL: пул соединений
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # сек жизни соединения
+
+# Отложенная запись изменений броска (write_behind.py): брошенный поток
+# (путь так и не выбран) записывается через столько секунд
+THROW_WRITE_DELAY = float(os.getenv("THROW_WRITE_DELAY", "120"))
+
+# Кэш telegram_id -> users.id (user_cache.py), записей; 0 — выключен
+USER_ID_CACHE_SIZE = int(os.getenv("USER_ID_CACHE_SIZE", "50000"))
+# last_interaction пишется пачкой раз в столько секунд (write_behind.py)
+LAST_INTERACTION_FLUSH_INTERVAL = float(os.getenv("LAST_INTERACTION_FLUSH_INTERVAL", "60"))
+
+# Инкрементальный колоночный экспорт (columnar_export.py, нужен pyarrow)
+ANALYTICS_EXPORT_DIR = os.getenv("ANALYTICS_EXPORT_DIR", "analytics_export")
+ANALYTICS_EXPORT_FORMAT = os.getenv("ANALYTICS_EXPORT_FORMAT", "parquet")  # parquet / arrow
+ANALYTICS_EXPORT_COMPRESSION = os.getenv("ANALYTICS_EXPORT_COMPRESSION", "zstd")
+# Выгружаются только строки старше стольких минут: бросок дописывается
+# (путь, вопросы) после вставки, выгруженные строки не перечитываются
+ANALYTICS_EXPORT_SETTLE_MINUTES = int(os.getenv("ANALYTICS_EXPORT_SETTLE_MINUTES", "60"))
+
 # Dice configuration - будет загружаться из dice_meanings.py
 # Basic набор: 16 символов
 DICE_SET = "basic"  # basic / action / adventure
@@ -26,5 +60,65 @@ AI_MODEL = "gpt-3.5-turbo"
 AI_TEMPERATURE = 0.8
 AI_MAX_TOKENS = 500
 
+# Потоковая выдача интерпретации (правка одного сообщения по мере генерации)
+AI_STREAMING = os.getenv("AI_STREAMING", "true").lower() == "true"
+# Минимальный интервал между edit_message_text (сек). Telegram режет частые
+# правки одного сообщения, ~1 раз в секунду — безопасный предел
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.0"))
+
+# Интерпретация и 4 пути одним JSON-запросом (generate_reading).
+# false — прежний режим из двух запросов. В этом режиме стрим не используется
+AI_COMBINED_READING = os.getenv("AI_COMBINED_READING", "false").lower() == "true"
+
+# Спекулятивная генерация вопросов для рефлексии, пока пользователь выбирает путь.
+# Бюджет — сколько путей (из 4, по порядку STORY_PATHS) генерировать заранее; 0 — выключено
+AI_SPECULATIVE_PATHS = int(os.getenv("AI_SPECULATIVE_PATHS", "4"))
+AI_SPECULATION_TIMEOUT = float(os.getenv("AI_SPECULATION_TIMEOUT", "30"))
+
+# Кэш ответов ИИ (ai_cache.py)
+AI_CACHE_ENABLED = os.getenv("AI_CACHE_ENABLED", "true").lower() == "true"
+AI_CACHE_MAX_ENTRIES = int(os.getenv("AI_CACHE_MAX_ENTRIES", "2048"))
+AI_CACHE_TTL = int(os.getenv("AI_CACHE_TTL", str(7 * 24 * 3600)))  # секунды
+# Порог косинусной близости для похожих ситуаций (0 — только точное совпадение)
+AI_CACHE_SIMILARITY = float(os.getenv("AI_CACHE_SIMILARITY", "0"))
+
+# Офлайн-библиотека интерпретаций (interpretation_library.py)
+INTERPRETATION_LIBRARY_PATH = os.getenv("INTERPRETATION_LIBRARY_PATH", "interpretation_library.json.gz")
+# Бюджет задержки интерпретации (сек): не успели — отдаём текст из библиотеки.
+# 0 — ждать ответа ИИ без ограничения
+AI_LATENCY_BUDGET = float(os.getenv("AI_LATENCY_BUDGET", "0"))
+
+# Регулятор запросов к OpenAI (ai_governor.py). 0 — без ограничения
+AI_RPM_LIMIT = int(os.getenv("AI_RPM_LIMIT", "500"))  # запросов в минуту
+AI_TPM_LIMIT = int(os.getenv("AI_TPM_LIMIT", "200000"))  # токенов в минуту
+AI_MAX_CONCURRENCY = int(os.getenv("AI_MAX_CONCURRENCY", "32"))  # одновременных запросов
+AI_QUEUE_TIMEOUT = float(os.getenv("AI_QUEUE_TIMEOUT", "20"))  # сек ожидания слота, затем fallback
+
+# Устойчивость вызовов OpenAI (ai_resilience.py)
+AI_CALL_DEADLINE = float(os.getenv("AI_CALL_DEADLINE", "25"))  # сек на вызов, включая повторы (с выдачи слота)
+AI_MAX_RETRIES = int(os.getenv("AI_MAX_RETRIES", "2"))  # повторы только для 429/5xx
+AI_RETRY_BASE_DELAY = float(os.getenv("AI_RETRY_BASE_DELAY", "0.5"))  # сек, растёт экспоненциально
+AI_HEDGING = os.getenv("AI_HEDGING", "false").lower() == "true"  # дубликат запроса после p95
+AI_HEDGE_MIN_DELAY = float(os.getenv("AI_HEDGE_MIN_DELAY", "3"))  # сек, нижняя граница задержки hedge
+AI_BREAKER_FAILURE_THRESHOLD = int(os.getenv("AI_BREAKER_FAILURE_THRESHOLD", "5"))  # 0 — без breaker
+AI_BREAKER_RESET_TIMEOUT = float(os.getenv("AI_BREAKER_RESET_TIMEOUT", "30"))  # сек до пробного вызова
+
+# HTTP-транспорт к OpenAI: общий пул соединений для всех генераторов
+AI_HTTP2 = os.getenv("AI_HTTP2", "true").lower() == "true"
+AI_POOL_MAX_CONNECTIONS = int(os.getenv("AI_POOL_MAX_CONNECTIONS", "100"))
+AI_POOL_MAX_KEEPALIVE = int(os.getenv("AI_POOL_MAX_KEEPALIVE", "20"))
+AI_KEEPALIVE_EXPIRY = float(os.getenv("AI_KEEPALIVE_EXPIRY", "60"))  # сек простоя соединения
+AI_CONNECT_TIMEOUT = float(os.getenv("AI_CONNECT_TIMEOUT", "5"))  # сек на соединение/запись
+AI_READ_TIMEOUT = float(os.getenv("AI_READ_TIMEOUT", "30"))  # сек между байтами ответа
+AI_PREWARM_CONNECTIONS = int(os.getenv("AI_PREWARM_CONNECTIONS", "2"))  # соединений при старте
+
+# Телеметрия ИИ (ai_metrics.py): /metrics в формате Prometheus.
+# Только на отдельном внутреннем сервере METRICS_HOST:METRICS_PORT (0 — не
+# запускать), не на публичном webhook-порту
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+# Если задан — /metrics требует заголовок Authorization: Bearer <токен>
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
 # Admin settings
 ADMIN_IDS = os.getenv("ADMIN_IDS", "").split(",")  # Telegram IDs через запятую
@@ -1,20 +1,34 @@
 # database.py - Database models and operations
 """
 SQLAlchemy модели для хранения пользователей и бросков кубиков
+
+Доступ к базе асинхронный (AsyncEngine): SQLite через aiosqlite,
+PostgreSQL через asyncpg. Все CRUD-функции — корутины.
+Настройки движка под бэкенд — в storage.py.
 """
 
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Text, ForeignKey
+from sqlalchemy import (
+    Column, Integer, String, Date, DateTime, Text, ForeignKey, select, update, func, bindparam, tuple_
+)
+from sqlalchemy.ext.asyncio import async_sessionmaker, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, Session, relationship
-from datetime import datetime
-from typing import Optional, List
+from sqlalchemy.engine import Row
+from sqlalchemy.orm import relationship
+from datetime import date, datetime, timedelta
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Optional, List, Tuple
 import json
 
 from config import DATABASE_URL
+from migrations import migrate
+from storage import create_storage_engine
+from symbol_registry import pack_layout
+from user_cache import user_ids
 
 # Database setup
-engine = create_engine(DATABASE_URL, echo=False, connect_args={"check_same_thread": False})
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+engine = create_storage_engine(DATABASE_URL)
+# expire_on_commit=False: объекты остаются читаемыми после закрытия сессии
+SessionLocal = async_sessionmaker(engine, expire_on_commit=False)
 Base = declarative_base()
 
 
@@ -61,6 +75,10 @@ class DiceThrow(Base):
     gift_symbol = Column(String, nullable=True)  # дар
     step_symbol = Column(String, nullable=True)  # шаг
 
+    # Все шесть символов одним целым: 6 × 4 бита ID из symbol_registry
+    # (NULL — у бросков, которые не упаковать, например из трёх символов)
+    layout = Column(Integer, nullable=True)
+
     # ИИ интерпретация
     interpretation = Column(Text, nullable=True)
 
@@ -89,81 +107,179 @@ class DiceThrow(Base):
         self.reflection_prompts = json.dumps(prompts, ensure_ascii=False)
 
 
+class StatsCounter(Base):
+    """Счётчик статистики, обновляется в транзакции вместе с данными"""
+    __tablename__ = "stats_counters"
+
+    name = Column(String, primary_key=True)  # users / throws / completed_throws / path:<key>
+    value = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<StatsCounter {self.name}={self.value}>"
+
+
+class DailyStat(Base):
+    """Дневной срез (UTC): обновляется в транзакции вместе с данными, как stats_counters"""
+    __tablename__ = "daily_stats"
+
+    day = Column(Date, primary_key=True)
+    new_users = Column(Integer, nullable=False, default=0)
+    throws = Column(Integer, nullable=False, default=0)
+    completions = Column(Integer, nullable=False, default=0)  # по дню броска
+    returning_users = Column(Integer, nullable=False, default=0)  # по дню второго броска
+
+    def __repr__(self):
+        return f"<DailyStat {self.day}>"
+
+
+# Столбцы daily_stats с дневными значениями
+DAILY_FIELDS = ("new_users", "throws", "completions", "returning_users")
+
+
+# Имена счётчиков
+COUNTER_USERS = "users"
+COUNTER_THROWS = "throws"
+COUNTER_COMPLETED = "completed_throws"
+COUNTER_PATH_PREFIX = "path:"
+
+
 # ===================================
 # DATABASE INITIALIZATION
 # ===================================
 
-def init_db():
-    """Создать все таблицы в базе данных"""
-    Base.metadata.create_all(bind=engine)
+async def init_db():
+    """
+    Подготовить базу: создать недостающие таблицы и применить миграции
+
+    Индексы и изменения существующих таблиц — в migrations.py.
+    """
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    await migrate(engine)
+
+    # База, созданная до появления stats_counters: заполняем счётчики один раз
+    async with SessionLocal() as session:
+        if await session.get(StatsCounter, COUNTER_USERS) is None:
+            await reconcile_counters(session)
+            await session.commit()
+
+    # И дневные срезы для базы, созданной до daily_stats
+    async with SessionLocal() as session:
+        has_rollups = (await session.execute(select(DailyStat.day).limit(1))).first() is not None
+        if not has_rollups and (await get_counters(session)).get(COUNTER_USERS, 0) > 0:
+            await backfill_daily_stats(session)
+            await session.commit()
+
     print("✅ База данных инициализирована")
 
 
-def get_db() -> Session:
-    """Получить сессию базы данных"""
-    db = SessionLocal()
-    try:
-        return db
-    finally:
-        pass  # Сессию закроет вызывающий код
+async def close_db():
+    """Закрыть пул соединений"""
+    await engine.dispose()
+
+
+@asynccontextmanager
+async def snapshot_session() -> AsyncIterator[AsyncSession]:
+    """
+    Сессия для отчётов: все запросы читают одно состояние базы
+
+    PostgreSQL — транзакция REPEATABLE READ. SQLite — явный BEGIN: драйвер
+    sqlite3 сам открывает транзакцию только перед записью, и каждый SELECT
+    иначе видел бы свой момент. В WAL такой читатель не мешает боту писать.
+    Ничего не коммитит: транзакция откатывается при выходе.
+    """
+    async with SessionLocal() as session:
+        if engine.dialect.name == "postgresql":
+            await session.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+        elif engine.dialect.name == "sqlite":
+            connection = await session.connection()
+            await connection.exec_driver_sql("BEGIN")
+        try:
+            yield session
+        finally:
+            await session.rollback()
 
 
 # ===================================
 # CRUD OPERATIONS - USERS
 # ===================================
+#
+# Функции работают в переданной сессии и не коммитят: транзакцией
+# управляет вызывающий код (DbSessionMiddleware — одна сессия на апдейт).
 
-def create_user(telegram_id: str, username: str = None, full_name: str = None) -> User:
+async def create_user(session: AsyncSession, telegram_id: str, username: str = None, full_name: str = None) -> User:
     """Создать нового пользователя"""
-    db = get_db()
-    try:
-        user = User(
-            telegram_id=telegram_id,
-            username=username,
-            full_name=full_name
-        )
-        db.add(user)
-        db.commit()
-        db.refresh(user)
-        return user
-    finally:
-        db.close()
+    user = User(
+        telegram_id=telegram_id,
+        username=username,
+        full_name=full_name
+    )
+    session.add(user)
+    await session.flush()
+    await increment_counters(session, {COUNTER_USERS: 1})
+    await increment_daily(session, user.created_at.date(), {"new_users": 1})
+    return user
 
 
-def get_user(telegram_id: str) -> Optional[User]:
+async def get_user(session: AsyncSession, telegram_id: str) -> Optional[User]:
     """Получить пользователя по Telegram ID"""
-    db = get_db()
-    try:
-        user = db.query(User).filter(User.telegram_id == telegram_id).first()
-        return user
-    finally:
-        db.close()
+    result = await session.execute(select(User).where(User.telegram_id == telegram_id))
+    return result.scalars().first()
 
 
-def get_or_create_user(telegram_id: str, username: str = None, full_name: str = None) -> User:
+async def get_or_create_user(
+    session: AsyncSession,
+    telegram_id: str,
+    username: str = None,
+    full_name: str = None
+) -> User:
     """Получить или создать пользователя"""
-    user = get_user(telegram_id)
+    user = await get_user(session, telegram_id)
     if not user:
-        user = create_user(telegram_id, username, full_name)
+        user = await create_user(session, telegram_id, username, full_name)
     return user
 
 
-def update_last_interaction(telegram_id: str):
-    """Обновить время последнего взаимодействия"""
-    db = get_db()
-    try:
-        user = db.query(User).filter(User.telegram_id == telegram_id).first()
-        if user:
-            user.last_interaction = datetime.utcnow()
-            db.commit()
-    finally:
-        db.close()
+async def get_or_create_user_id(
+    session: AsyncSession,
+    telegram_id: str,
+    username: str = None,
+    full_name: str = None
+) -> int:
+    """users.id по Telegram ID: из кэша процесса, иначе SELECT (или создание)"""
+    user_id = user_ids.get(telegram_id)
+    if user_id is not None:
+        return user_id
+
+    user = await get_user(session, telegram_id)
+    if user:
+        user_ids.set(telegram_id, user.id)
+        return user.id
+
+    # Новый пользователь в кэш не попадает, пока транзакция не закоммичена
+    user = await create_user(session, telegram_id, username, full_name)
+    return user.id
+
+
+async def update_last_interactions(session: AsyncSession, interactions: Dict[str, datetime]):
+    """Обновить время последнего взаимодействия пачкой: {telegram_id: время}"""
+    if not interactions:
+        return
+    connection = await session.connection()
+    await connection.execute(
+        User.__table__.update()
+        .where(User.__table__.c.telegram_id == bindparam("tid"))
+        .values(last_interaction=bindparam("ts")),
+        [{"tid": telegram_id, "ts": ts} for telegram_id, ts in interactions.items()]
+    )
 
 
 # ===================================
 # CRUD OPERATIONS - DICE THROWS
 # ===================================
 
-def save_throw(
+async def save_throw(
+    session: AsyncSession,
     telegram_id: str,
     situation: str,
     symbol: str,
@@ -174,186 +290,368 @@ def save_throw(
     step_symbol: str = None,
     interpretation: str = None
 ) -> DiceThrow:
-    """Сохранить бросок кубиков (6 символов)"""
-    db = get_db()
-    try:
-        user = get_or_create_user(telegram_id)
-
-        throw = DiceThrow(
-            user_id=user.id,
-            situation=situation,
-            symbol=symbol,  # root
-            archetype=archetype,  # outer
-            emotion=emotion,  # inner
-            shadow_symbol=shadow_symbol,  # тень
-            gift_symbol=gift_symbol,  # дар
-            step_symbol=step_symbol,  # шаг
-            interpretation=interpretation
-        )
-        db.add(throw)
-        db.commit()
-        db.refresh(throw)
-        return throw
-    finally:
-        db.close()
-
-
-def update_throw(
+    """Сохранить бросок кубиков (6 символов). ID доступен сразу (flush)"""
+    user_id = await get_or_create_user_id(session, telegram_id)
+
+    throw = DiceThrow(
+        user_id=user_id,
+        situation=situation,
+        symbol=symbol,  # root
+        archetype=archetype,  # outer
+        emotion=emotion,  # inner
+        shadow_symbol=shadow_symbol,  # тень
+        gift_symbol=gift_symbol,  # дар
+        step_symbol=step_symbol,  # шаг
+        layout=pack_layout([symbol, archetype, emotion, shadow_symbol, gift_symbol, step_symbol]),
+        interpretation=interpretation
+    )
+    session.add(throw)
+    await session.flush()
+    await increment_counters(session, {COUNTER_THROWS: 1})
+
+    # Второй бросок пользователя — он вернулся (дальше не считаем).
+    # Не больше трёх строк по индексу (user_id, timestamp)
+    earlier_throws = await _count(
+        session,
+        select(DiceThrow.id)
+        .where(DiceThrow.user_id == user_id, DiceThrow.id <= throw.id)
+        .limit(3)
+    )
+    await increment_daily(session, throw.timestamp.date(), {
+        "throws": 1,
+        "returning_users": 1 if earlier_throws == 2 else 0,
+    })
+    return throw
+
+
+async def update_throw(
+    session: AsyncSession,
     throw_id: int,
     interpretation: str = None,
     chosen_path: str = None,
     reflection_prompts: List[str] = None
 ):
-    """Обновить информацию о броске"""
-    db = get_db()
-    try:
-        throw = db.query(DiceThrow).filter(DiceThrow.id == throw_id).first()
-        if throw:
-            if interpretation:
-                throw.interpretation = interpretation
-            if chosen_path:
-                throw.chosen_path = chosen_path
-            if reflection_prompts:
-                throw.set_reflection_prompts(reflection_prompts)
-            db.commit()
-    finally:
-        db.close()
-
-
-def get_user_throws(telegram_id: str, limit: int = 10) -> List[DiceThrow]:
+    """
+    Обновить информацию о броске одним UPDATE
+
+    При смене chosen_path предыдущее значение читается в той же транзакции,
+    чтобы поправить счётчики завершённых бросков и путей.
+    """
+    values = {}
+    if interpretation:
+        values["interpretation"] = interpretation
+    if chosen_path:
+        values["chosen_path"] = chosen_path
+    if reflection_prompts:
+        values["reflection_prompts"] = json.dumps(reflection_prompts, ensure_ascii=False)
+    if not values:
+        return
+
+    deltas = {}
+    completed_day = None
+    if chosen_path:
+        result = await session.execute(
+            select(DiceThrow.chosen_path, DiceThrow.timestamp).where(DiceThrow.id == throw_id)
+        )
+        row = result.first()
+        if row is None:
+            return
+        previous_path, thrown_at = row
+        if previous_path != chosen_path:
+            deltas[COUNTER_PATH_PREFIX + chosen_path] = 1
+            if previous_path is None:
+                deltas[COUNTER_COMPLETED] = 1
+                completed_day = thrown_at.date()
+            else:
+                deltas[COUNTER_PATH_PREFIX + previous_path] = -1
+
+    await session.execute(update(DiceThrow).where(DiceThrow.id == throw_id).values(**values))
+    await increment_counters(session, deltas)
+    if completed_day is not None:
+        await increment_daily(session, completed_day, {"completions": 1})
+
+
+async def get_user_throws(session: AsyncSession, telegram_id: str, limit: int = 10) -> List[DiceThrow]:
     """Получить историю бросков пользователя"""
-    db = get_db()
-    try:
-        user = get_user(telegram_id)
-        if not user:
-            return []
-
-        throws = db.query(DiceThrow)\
-            .filter(DiceThrow.user_id == user.id)\
-            .order_by(DiceThrow.timestamp.desc())\
-            .limit(limit)\
-            .all()
-        return throws
-    finally:
-        db.close()
-
-
-def get_throw_by_id(throw_id: int) -> Optional[DiceThrow]:
+    result = await session.execute(
+        select(DiceThrow)
+        .join(User, DiceThrow.user_id == User.id)
+        .where(User.telegram_id == telegram_id)
+        .order_by(DiceThrow.timestamp.desc())
+        .limit(limit)
+    )
+    return list(result.scalars().all())
+
+
+async def get_user_throws_page(
+    session: AsyncSession,
+    telegram_id: str,
+    limit: int = 5,
+    before: Tuple[datetime, int] = None,
+    after: Tuple[datetime, int] = None,
+    preview_chars: int = 60
+) -> Tuple[List[Row], bool]:
+    """
+    Страница истории бросков (keyset-пагинация по курсору (timestamp, id))
+
+    before — броски старше курсора, after — новее; без курсора — самые новые.
+    Выбираются только поля для списка: id, timestamp, начало ситуации
+    (preview_chars + 1 символ — чтобы знать, обрезана ли она), три символа
+    и путь. Интерпретация и вопросы не читаются.
+
+    Возвращает строки от новых к старым и флаг «в этом направлении есть ещё».
+    Стоимость не зависит от глубины: поиск по индексу (user_id, timestamp).
+    """
+    newer = after is not None
+    order = (DiceThrow.timestamp, DiceThrow.id) if newer else (DiceThrow.timestamp.desc(), DiceThrow.id.desc())
+
+    statement = (
+        select(
+            DiceThrow.id,
+            DiceThrow.timestamp,
+            func.substr(DiceThrow.situation, 1, preview_chars + 1).label("situation"),
+            DiceThrow.symbol,
+            DiceThrow.archetype,
+            DiceThrow.emotion,
+            DiceThrow.chosen_path
+        )
+        .join(User, DiceThrow.user_id == User.id)
+        .where(User.telegram_id == telegram_id)
+        .order_by(*order)
+        .limit(limit + 1)
+    )
+    if newer:
+        statement = statement.where(tuple_(DiceThrow.timestamp, DiceThrow.id) > tuple_(*after))
+    elif before is not None:
+        statement = statement.where(tuple_(DiceThrow.timestamp, DiceThrow.id) < tuple_(*before))
+
+    rows = list((await session.execute(statement)).all())
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if newer:
+        rows.reverse()
+    return rows, has_more
+
+
+async def get_throw_by_id(session: AsyncSession, throw_id: int) -> Optional[DiceThrow]:
     """Получить бросок по ID"""
-    db = get_db()
-    try:
-        throw = db.query(DiceThrow).filter(DiceThrow.id == throw_id).first()
-        return throw
-    finally:
-        db.close()
+    return await session.get(DiceThrow, throw_id)
+
+
+# ===================================
+# COUNTERS
+# ===================================
+
+def _dialect_insert(session: AsyncSession):
+    """INSERT с поддержкой ON CONFLICT для текущего бэкенда"""
+    if session.bind.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
+
+async def increment_counters(session: AsyncSession, deltas: Dict[str, int]):
+    """Атомарно прибавить значения к счётчикам (в транзакции вызывающего)"""
+    insert = _dialect_insert(session)
+    for name, delta in deltas.items():
+        if not delta:
+            continue
+        statement = insert(StatsCounter).values(name=name, value=delta)
+        statement = statement.on_conflict_do_update(
+            index_elements=[StatsCounter.name],
+            set_={"value": StatsCounter.value + delta}
+        )
+        await session.execute(statement)
+
+
+async def reconcile_counters(session: AsyncSession) -> Dict[str, int]:
+    """Пересчитать все счётчики из исходных таблиц (в транзакции вызывающего)"""
+    counters = {
+        COUNTER_USERS: await _count(session, select(User.id)),
+        COUNTER_THROWS: await _count(session, select(DiceThrow.id)),
+        COUNTER_COMPLETED: await _count(session, select(DiceThrow.id).where(DiceThrow.chosen_path.isnot(None))),
+    }
+    path_stats = await session.execute(
+        select(DiceThrow.chosen_path, func.count(DiceThrow.id))
+        .where(DiceThrow.chosen_path.isnot(None))
+        .group_by(DiceThrow.chosen_path)
+    )
+    for path, count in path_stats.all():
+        counters[COUNTER_PATH_PREFIX + path] = count
+
+    await session.execute(StatsCounter.__table__.delete())
+    session.add_all([StatsCounter(name=name, value=value) for name, value in counters.items()])
+    await session.flush()
+    return counters
+
+
+async def get_counters(session: AsyncSession) -> Dict[str, int]:
+    """Все счётчики одним запросом к маленькой таблице"""
+    result = await session.execute(select(StatsCounter.name, StatsCounter.value))
+    return {name: value for name, value in result.all()}
+
+
+# ===================================
+# DAILY ROLLUPS
+# ===================================
+
+async def increment_daily(session: AsyncSession, day: date, deltas: Dict[str, int]):
+    """Атомарно прибавить значения к дневному срезу (в транзакции вызывающего)"""
+    deltas = {field: delta for field, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    insert = _dialect_insert(session)
+    statement = insert(DailyStat).values(
+        day=day, **{field: deltas.get(field, 0) for field in DAILY_FIELDS}
+    )
+    statement = statement.on_conflict_do_update(
+        index_elements=[DailyStat.day],
+        set_={field: getattr(DailyStat, field) + delta for field, delta in deltas.items()}
+    )
+    await session.execute(statement)
+
+
+def _as_date(value) -> date:
+    """func.date() отдаёт строку в SQLite и date в PostgreSQL"""
+    return date.fromisoformat(value) if isinstance(value, str) else value
+
+
+async def backfill_daily_stats(session: AsyncSession, since: date = None) -> int:
+    """
+    Пересчитать daily_stats из исходных таблиц (в транзакции вызывающего)
+
+    since — пересчитать только дни начиная с этой даты (остальные строки
+    не трогаются); без since таблица собирается заново. Возвращает число дней.
+    """
+    def day_of(column):
+        return func.date(column)
+
+    def window(statement, column):
+        return statement.where(column >= datetime.combine(since, datetime.min.time())) if since else statement
+
+    rows: Dict[date, Dict[str, int]] = {}
+
+    def collect(field: str, result):
+        for day, count in result.all():
+            rows.setdefault(_as_date(day), dict.fromkeys(DAILY_FIELDS, 0))[field] = count
+
+    collect("new_users", await session.execute(window(
+        select(day_of(User.created_at), func.count(User.id)), User.created_at
+    ).group_by(day_of(User.created_at))))
+
+    collect("throws", await session.execute(window(
+        select(day_of(DiceThrow.timestamp), func.count(DiceThrow.id)), DiceThrow.timestamp
+    ).group_by(day_of(DiceThrow.timestamp))))
+
+    collect("completions", await session.execute(window(
+        select(day_of(DiceThrow.timestamp), func.count(DiceThrow.id))
+        .where(DiceThrow.chosen_path.isnot(None)), DiceThrow.timestamp
+    ).group_by(day_of(DiceThrow.timestamp))))
+
+    # День второго броска каждого пользователя
+    ranked = select(
+        DiceThrow.timestamp,
+        func.row_number().over(
+            partition_by=DiceThrow.user_id,
+            order_by=(DiceThrow.timestamp, DiceThrow.id)
+        ).label("n")
+    ).subquery()
+    collect("returning_users", await session.execute(window(
+        select(day_of(ranked.c.timestamp), func.count()).where(ranked.c.n == 2), ranked.c.timestamp
+    ).group_by(day_of(ranked.c.timestamp))))
+
+    delete = DailyStat.__table__.delete()
+    if since:
+        delete = delete.where(DailyStat.day >= since)
+    await session.execute(delete)
+    session.add_all([DailyStat(day=day, **values) for day, values in rows.items()])
+    await session.flush()
+    return len(rows)
+
+
+async def get_daily_stats(session: AsyncSession, days: int = 30) -> List[DailyStat]:
+    """Дневные срезы за последние days дней (по возрастанию даты)"""
+    since = datetime.utcnow().date() - timedelta(days=days - 1)
+    result = await session.execute(
+        select(DailyStat).where(DailyStat.day >= since).order_by(DailyStat.day)
+    )
+    return list(result.scalars().all())
 
 
 # ===================================
 # STATISTICS
 # ===================================
 
-def get_stats() -> dict:
-    """Получить статистику бота"""
-    db = get_db()
-    try:
-        from sqlalchemy import func
-        from datetime import timedelta
-
-        users_count = db.query(User).count()
-        throws_count = db.query(DiceThrow).count()
-
-        # Активные пользователи (за последние 7 дней)
-        week_ago = datetime.utcnow() - timedelta(days=7)
-        active_users = db.query(User).filter(User.last_interaction >= week_ago).count()
-
-        # Завершённые броски (с выбранным путём)
-        completed_throws = db.query(DiceThrow).filter(DiceThrow.chosen_path.isnot(None)).count()
-
-        # Популярные пути
-        path_stats = db.query(
-            DiceThrow.chosen_path,
-            func.count(DiceThrow.id).label('count')
-        ).filter(
-            DiceThrow.chosen_path.isnot(None)
-        ).group_by(
-            DiceThrow.chosen_path
-        ).all()
-
-        path_distribution = {path: count for path, count in path_stats}
-
-        # Среднее бросков на пользователя
-        avg_throws_per_user = throws_count / users_count if users_count > 0 else 0
-
-        # Конверсия (% завершённых бросков)
-        completion_rate = (completed_throws / throws_count * 100) if throws_count > 0 else 0
-
-        return {
-            "users": users_count,
-            "throws": throws_count,
-            "active_users_7d": active_users,
-            "completed_throws": completed_throws,
-            "completion_rate": round(completion_rate, 1),
-            "avg_throws_per_user": round(avg_throws_per_user, 2),
-            "path_distribution": path_distribution
-        }
-    finally:
-        db.close()
-
-
-def get_detailed_analytics() -> dict:
-    """Получить детальную аналитику"""
-    db = get_db()
-    try:
-        from sqlalchemy import func
-        from datetime import timedelta
-
-        now = datetime.utcnow()
-
-        # Новые пользователи по дням (последние 30 дней)
-        users_by_day = db.query(
-            func.date(User.created_at).label('date'),
-            func.count(User.id).label('count')
-        ).filter(
-            User.created_at >= now - timedelta(days=30)
-        ).group_by(
-            func.date(User.created_at)
-        ).all()
-
-        # Броски по дням (последние 30 дней)
-        throws_by_day = db.query(
-            func.date(DiceThrow.timestamp).label('date'),
-            func.count(DiceThrow.id).label('count')
-        ).filter(
-            DiceThrow.timestamp >= now - timedelta(days=30)
-        ).group_by(
-            func.date(DiceThrow.timestamp)
-        ).all()
-
-        # Retention: сколько пользователей вернулись
-        users_with_multiple_throws = db.query(
-            DiceThrow.user_id,
-            func.count(DiceThrow.id).label('count')
-        ).group_by(
-            DiceThrow.user_id
-        ).having(
-            func.count(DiceThrow.id) > 1
-        ).count()
-
-        total_users = db.query(User).count()
-        retention_rate = (users_with_multiple_throws / total_users * 100) if total_users > 0 else 0
-
-        return {
-            "users_by_day": [{"date": str(date), "count": count} for date, count in users_by_day],
-            "throws_by_day": [{"date": str(date), "count": count} for date, count in throws_by_day],
-            "retention_rate": round(retention_rate, 1),
-            "returning_users": users_with_multiple_throws
-        }
-    finally:
-        db.close()
-
-
-# Инициализация при импорте
-if __name__ != "__main__":
-    import os
-    if not os.path.exists("dice_bot.db"):
-        init_db()
+async def _count(session: AsyncSession, statement) -> int:
+    """COUNT(*) по запросу"""
+    result = await session.execute(select(func.count()).select_from(statement.subquery()))
+    return result.scalar_one()
+
+
+async def get_stats(session: AsyncSession) -> dict:
+    """Получить статистику бота (из stats_counters, без подсчёта по таблицам)"""
+    counters = await get_counters(session)
+    users_count = counters.get(COUNTER_USERS, 0)
+    throws_count = counters.get(COUNTER_THROWS, 0)
+    completed_throws = counters.get(COUNTER_COMPLETED, 0)
+
+    # Активные пользователи (за последние 7 дней)
+    week_ago = datetime.utcnow() - timedelta(days=7)
+    active_users = await _count(session, select(User.id).where(User.last_interaction >= week_ago))
+
+    # Популярные пути
+    path_distribution = {
+        name[len(COUNTER_PATH_PREFIX):]: value
+        for name, value in counters.items()
+        if name.startswith(COUNTER_PATH_PREFIX) and value > 0
+    }
+
+    # Среднее бросков на пользователя
+    avg_throws_per_user = throws_count / users_count if users_count > 0 else 0
+
+    # Конверсия (% завершённых бросков)
+    completion_rate = (completed_throws / throws_count * 100) if throws_count > 0 else 0
+
+    return {
+        "users": users_count,
+        "throws": throws_count,
+        "active_users_7d": active_users,
+        "completed_throws": completed_throws,
+        "completion_rate": round(completion_rate, 1),
+        "avg_throws_per_user": round(avg_throws_per_user, 2),
+        "path_distribution": path_distribution
+    }
+
+
+async def get_detailed_analytics(session: AsyncSession, days: int = 30) -> dict:
+    """
+    Получить детальную аналитику за последние days дней
+
+    Читает только daily_stats (одна строка на день), поэтому окна
+    в 90 и 365 дней стоят столько же, сколько 30.
+    """
+    daily = await get_daily_stats(session, days)
+
+    def by_day(field: str) -> List[dict]:
+        return [
+            {"date": str(row.day), "count": getattr(row, field)}
+            for row in daily if getattr(row, field)
+        ]
+
+    # Retention: сколько пользователей вернулись (сделали второй бросок) за всё время
+    result = await session.execute(select(func.coalesce(func.sum(DailyStat.returning_users), 0)))
+    users_with_multiple_throws = result.scalar_one()
+
+    total_users = (await get_counters(session)).get(COUNTER_USERS, 0)
+    retention_rate = (users_with_multiple_throws / total_users * 100) if total_users > 0 else 0
+
+    return {
+        "days": days,
+        "users_by_day": by_day("new_users"),
+        "throws_by_day": by_day("throws"),
+        "completions_by_day": by_day("completions"),
+        "returning_by_day": by_day("returning_users"),
+        "retention_rate": round(retention_rate, 1),
+        "returning_users": users_with_multiple_throws
+    }
@@ -2,82 +2,361 @@
 # export_analytics.py - Export analytics to CSV
 """
 Скрипт для экспорта аналитики в CSV файлы
-Использование: python export_analytics.py
+Использование:
+    python export_analytics.py [--days 365]     # CSV-сводки
+    python export_analytics.py --compress gzip  # каждый файл .csv.gz (или zstd)
+    python export_analytics.py --archive        # все отчёты одним zip
+    python export_analytics.py --incremental    # новые броски и пользователи в Parquet/Arrow
+
+Данные по дням берутся из daily_stats (см. manage.py backfill-rollups).
+Инкрементальный экспорт — columnar_export.py.
 """
 
+import argparse
+import asyncio
 import csv
+import gzip
+import io
+import os
+import sys
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from database import get_stats, get_detailed_analytics, get_db, User, DiceThrow
+from typing import Dict, List, Tuple
+from sqlalchemy import select, func
+from analytics_engine import SymbolAnalytics, PATH_KEYS, POSITION_KEYS, get_symbol_analytics, retention
+from symbol_registry import SYMBOL_ORDER
+from database import (
+    get_stats, get_detailed_analytics, get_daily_stats, snapshot_session, init_db, close_db, User, DiceThrow
+)
 
-def export_stats_to_csv():
-    """Экспорт статистики в CSV"""
-    stats = get_stats()
-    analytics = get_detailed_analytics()
+# Строк users_detail за одну выборку с курсора
+EXPORT_CHUNK_SIZE = 1000
+# Потоков для записи и сжатия отчётов
+EXPORT_WORKERS = 4
 
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+COMPRESSION_SUFFIXES = {"none": "", "gzip": ".gz", "zstd": ".zst"}
+
+USERS_DETAIL_HEADER = ['Telegram ID', 'Username', 'Full Name', 'Created At', 'Last Interaction', 'Total Throws']
+
+
+def _format_datetime(value) -> str:
+    return value.strftime('%Y-%m-%d %H:%M:%S') if value else ''
+
+
+def peak_rss_mb():
+    """Пиковый RSS процесса в МБ (None, где модуля resource нет — Windows)"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдаёт килобайты, macOS — байты
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+# ===================================
+# ФАЙЛЫ ОТЧЁТОВ
+# ===================================
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise RuntimeError("Для сжатия zstd нужен пакет zstandard: pip install zstandard")
+    return zstandard
 
-    # 1. Основная статистика
-    with open(f'stats_summary_{timestamp}.csv', 'w', newline='', encoding='utf-8') as f:
-        writer = csv.writer(f)
-        writer.writerow(['Метрика', 'Значение'])
-        writer.writerow(['Всего пользователей', stats['users']])
-        writer.writerow(['Активных за 7 дней', stats['active_users_7d']])
-        writer.writerow(['Всего бросков', stats['throws']])
-        writer.writerow(['Завершённых бросков', stats['completed_throws']])
-        writer.writerow(['Процент завершения', f"{stats['completion_rate']}%"])
-        writer.writerow(['Среднее бросков/пользователь', stats['avg_throws_per_user']])
-        writer.writerow(['Retention rate', f"{analytics['retention_rate']}%"])
-        writer.writerow(['Вернувшихся пользователей', analytics['returning_users']])
-
-    # 2. Пути
-    with open(f'paths_{timestamp}.csv', 'w', newline='', encoding='utf-8') as f:
-        writer = csv.writer(f)
-        writer.writerow(['Путь', 'Количество', 'Процент'])
-        for path, count in stats['path_distribution'].items():
-            percentage = (count / stats['completed_throws'] * 100) if stats['completed_throws'] > 0 else 0
-            writer.writerow([path, count, f"{percentage:.1f}%"])
 
-    # 3. Пользователи по дням
-    with open(f'users_by_day_{timestamp}.csv', 'w', newline='', encoding='utf-8') as f:
+def open_report(path: str, compression: str):
+    """Текстовый файл отчёта, при необходимости со сжатием (gzip / zstd)"""
+    if compression == "gzip":
+        return gzip.open(path, 'wt', newline='', encoding='utf-8')
+    if compression == "zstd":
+        zstandard = _zstandard()
+        stream = zstandard.ZstdCompressor().stream_writer(open(path, 'wb'))
+        return io.TextIOWrapper(stream, newline='', encoding='utf-8')
+    return open(path, 'w', newline='', encoding='utf-8')
+
+
+def write_report(path: str, compression: str, header: List[str], rows: List[list]) -> str:
+    """Записать небольшой отчёт целиком (выполняется в пуле потоков)"""
+    with open_report(path, compression) as f:
         writer = csv.writer(f)
-        writer.writerow(['Дата', 'Новых пользователей'])
-        for item in analytics['users_by_day']:
-            writer.writerow([item['date'], item['count']])
+        writer.writerow(header)
+        writer.writerows(rows)
+    return path
+
+
+def archive_reports(paths: List[str], archive_path: str) -> str:
+    """Собрать отчёты в один zip и удалить исходные файлы"""
+    with zipfile.ZipFile(archive_path, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for path in paths:
+            archive.write(path, arcname=os.path.basename(path))
+    for path in paths:
+        os.remove(path)
+    return archive_path
+
+
+# ===================================
+# ОТЧЁТЫ
+# ===================================
+
+def build_small_reports(stats: dict, analytics: dict, daily: list) -> Dict[str, Tuple[List[str], List[list]]]:
+    """Небольшие отчёты: имя -> (заголовок, строки)"""
+    summary = [
+        ['Всего пользователей', stats['users']],
+        ['Активных за 7 дней', stats['active_users_7d']],
+        ['Всего бросков', stats['throws']],
+        ['Завершённых бросков', stats['completed_throws']],
+        ['Процент завершения', f"{stats['completion_rate']}%"],
+        ['Среднее бросков/пользователь', stats['avg_throws_per_user']],
+        ['Retention rate', f"{analytics['retention_rate']}%"],
+        ['Вернувшихся пользователей', analytics['returning_users']],
+    ]
+
+    paths = []
+    for path, count in stats['path_distribution'].items():
+        percentage = (count / stats['completed_throws'] * 100) if stats['completed_throws'] > 0 else 0
+        paths.append([path, count, f"{percentage:.1f}%"])
+
+    return {
+        'stats_summary': (['Метрика', 'Значение'], summary),
+        'paths': (['Путь', 'Количество', 'Процент'], paths),
+        'users_by_day': (
+            ['Дата', 'Новых пользователей'],
+            [[item['date'], item['count']] for item in analytics['users_by_day']]
+        ),
+        'throws_by_day': (
+            ['Дата', 'Бросков'],
+            [[item['date'], item['count']] for item in analytics['throws_by_day']]
+        ),
+        'daily': (
+            ['Дата', 'Новых пользователей', 'Бросков', 'Завершено', 'Вернулись'],
+            [[row.day, row.new_users, row.throws, row.completions, row.returning_users] for row in daily]
+        ),
+    }
+
+
+def build_symbol_reports(analytics: SymbolAnalytics) -> Dict[str, Tuple[List[str], List[list]]]:
+    """Отчёты analytics_engine: частоты по позициям, совместная встречаемость, пути"""
+    positions = [
+        [position, SYMBOL_ORDER[symbol], int(analytics.position_symbol[p, symbol])]
+        for p, position in enumerate(POSITION_KEYS)
+        for symbol in range(len(SYMBOL_ORDER))
+    ]
+
+    cooccurrence = [
+        [SYMBOL_ORDER[a]] + [int(count) for count in analytics.cooccurrence[a]]
+        for a in range(len(SYMBOL_ORDER))
+    ]
+
+    probabilities = analytics.path_probabilities()
+    abandon_rate = analytics.abandon_rate()
+    correlations = []
+    for p, position in enumerate(POSITION_KEYS):
+        for symbol in range(len(SYMBOL_ORDER)):
+            row = [position, SYMBOL_ORDER[symbol], int(analytics.path_counts[p, symbol].sum())]
+            row.append(f"{abandon_rate[p, symbol] * 100:.1f}%")
+            row += [f"{probability * 100:.1f}%" for probability in probabilities[p, symbol]]
+            correlations.append(row)
+
+    return {
+        'symbol_positions': (['Позиция', 'Символ', 'Выпадений'], positions),
+        'symbol_cooccurrence': (['Символ'] + list(SYMBOL_ORDER), cooccurrence),
+        'path_correlations': (
+            ['Позиция', 'Символ', 'Бросков', 'Брошено'] + [f'P({path})' for path in PATH_KEYS],
+            correlations
+        ),
+    }
 
-    # 4. Броски по дням
-    with open(f'throws_by_day_{timestamp}.csv', 'w', newline='', encoding='utf-8') as f:
+
+def build_retention_reports(weekly: List[dict], daily: List[dict]) -> Dict[str, Tuple[List[str], List[list]]]:
+    """Матрицы удержания: строка — когорта, столбец — доля активных в k-й период"""
+    def report(rows: List[dict], label: str) -> Tuple[List[str], List[list]]:
+        periods = max((len(row['retention']) for row in rows), default=1)
+        header = ['Когорта', 'Пользователей'] + [f'{label} {period}' for period in range(periods)]
+        table = []
+        for row in rows:
+            # Ещё не наступившие периоды — пустые ячейки
+            cells = [f"{share * 100:.1f}%" for share in row['retention']]
+            table.append([row['cohort'].isoformat(), row['size']] + cells + [''] * (periods - len(cells)))
+        return header, table
+
+    return {
+        'retention_weekly': report(weekly, 'Неделя'),
+        'retention_daily': report(daily, 'День'),
+    }
+
+
+def _users_detail_rows(chunk) -> List[list]:
+    return [
+        [
+            telegram_id,
+            username or '',
+            full_name or '',
+            _format_datetime(created_at),
+            _format_datetime(last_interaction),
+            throws
+        ]
+        for telegram_id, username, full_name, created_at, last_interaction, throws in chunk
+    ]
+
+
+async def export_users_detail(session, path: str, compression: str, pool: ThreadPoolExecutor):
+    """
+    Пользователи с числом бросков в CSV одним запросом
+
+    Броски считаются одним GROUP BY и присоединяются к users, строки идут
+    с серверного курсора пачками по EXPORT_CHUNK_SIZE. Пачка пишется
+    в файл в пуле потоков, пока из базы читается следующая, — память
+    не растёт с числом пользователей.
+
+    Возвращает (число строк, секунды).
+    """
+    throw_counts = (
+        select(DiceThrow.user_id, func.count(DiceThrow.id).label('throws'))
+        .group_by(DiceThrow.user_id)
+        .subquery()
+    )
+    statement = (
+        select(
+            User.telegram_id,
+            User.username,
+            User.full_name,
+            User.created_at,
+            User.last_interaction,
+            func.coalesce(throw_counts.c.throws, 0)
+        )
+        .outerjoin(throw_counts, throw_counts.c.user_id == User.id)
+        .order_by(User.id)
+        .execution_options(yield_per=EXPORT_CHUNK_SIZE)
+    )
+
+    loop = asyncio.get_running_loop()
+    started = time.perf_counter()
+    rows = 0
+    with open_report(path, compression) as f:
         writer = csv.writer(f)
-        writer.writerow(['Дата', 'Бросков'])
-        for item in analytics['throws_by_day']:
-            writer.writerow([item['date'], item['count']])
+        writer.writerow(USERS_DETAIL_HEADER)
+
+        pending = None
+        result = await session.stream(statement)
+        async for chunk in result.partitions():
+            # Файл пишет один поток за раз: дожидаемся предыдущей пачки
+            if pending is not None:
+                await pending
+            pending = loop.run_in_executor(pool, writer.writerows, _users_detail_rows(chunk))
+            rows += len(chunk)
+        if pending is not None:
+            await pending
+
+    return rows, time.perf_counter() - started
+
+
+async def export_stats_to_csv(days: int = 30, compression: str = "none", archive: bool = False) -> List[str]:
+    """
+    Экспорт статистики в CSV (данные по дням — за последние days дней)
+
+    Все отчёты читаются в одной транзакции (snapshot_session), поэтому
+    цифры в разных файлах согласованы. Небольшие отчёты пишутся
+    параллельно в пуле потоков, пока из той же транзакции выгружается
+    users_detail. compression — gzip / zstd для каждого файла; archive —
+    все отчёты одним zip-архивом.
 
-    # 5. Детальные данные пользователей
-    db = get_db()
+    Возвращает пути созданных файлов.
+    """
+    started = time.perf_counter()
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    # В архиве файлы и так сжаты
+    suffix = ".csv" + ("" if archive else COMPRESSION_SUFFIXES[compression])
+    file_compression = "none" if archive else compression
+    if file_compression == "zstd":
+        _zstandard()  # до создания файлов
+
+    loop = asyncio.get_running_loop()
+    with ThreadPoolExecutor(max_workers=EXPORT_WORKERS) as pool:
+        async with snapshot_session() as session:
+            stats = await get_stats(session)
+            analytics = await get_detailed_analytics(session, days)
+            daily = await get_daily_stats(session, days)
+            symbols = await get_symbol_analytics(session)
+            await retention.refresh(session)
+
+            reports = {
+                **build_small_reports(stats, analytics, daily),
+                **build_symbol_reports(symbols),
+                # Недельные когорты — все, дневные — за окно days
+                **build_retention_reports(retention.table("week", None), retention.table("day", days)),
+            }
+            writes = [
+                loop.run_in_executor(pool, write_report, f'{name}_{timestamp}{suffix}', file_compression, header, rows)
+                for name, (header, rows) in reports.items()
+            ]
+
+            users_detail_path = f'users_detail_{timestamp}{suffix}'
+            users_exported, elapsed = await export_users_detail(session, users_detail_path, file_compression, pool)
+
+        paths = list(await asyncio.gather(*writes)) + [users_detail_path]
+
+    rate = users_exported / elapsed if elapsed > 0 else 0
+    print(f"📤 users_detail: {users_exported} строк за {elapsed:.2f}с ({rate:.0f} строк/с)")
+
+    if archive:
+        paths = [archive_reports(paths, f'analytics_{timestamp}.zip')]
+
+    peak_rss = peak_rss_mb()
+    if peak_rss is not None:
+        print(f"📈 Пиковая память процесса: {peak_rss:.1f} МБ")
+
+    print(f"✅ Экспорт завершён за {time.perf_counter() - started:.2f}с! Файлы:")
+    for path in paths:
+        print(f"   - {path}")
+    return paths
+
+
+async def main(args: argparse.Namespace):
     try:
-        users = db.query(User).all()
-        with open(f'users_detail_{timestamp}.csv', 'w', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            writer.writerow(['Telegram ID', 'Username', 'Full Name', 'Created At', 'Last Interaction', 'Total Throws'])
-            for user in users:
-                throw_count = db.query(DiceThrow).filter(DiceThrow.user_id == user.id).count()
-                writer.writerow([
-                    user.telegram_id,
-                    user.username or '',
-                    user.full_name or '',
-                    user.created_at.strftime('%Y-%m-%d %H:%M:%S'),
-                    user.last_interaction.strftime('%Y-%m-%d %H:%M:%S'),
-                    throw_count
-                ])
-    finally:
-        db.close()
+        # Схема, миграции, счётчики и дневные срезы — как при старте бота:
+        # база могла ни разу не открываться новой версией
+        await init_db()
 
-    print(f"✅ Экспорт завершён! Файлы:")
-    print(f"   - stats_summary_{timestamp}.csv")
-    print(f"   - paths_{timestamp}.csv")
-    print(f"   - users_by_day_{timestamp}.csv")
-    print(f"   - throws_by_day_{timestamp}.csv")
-    print(f"   - users_detail_{timestamp}.csv")
+        if args.incremental:
+            from columnar_export import export_incremental
+            try:
+                exported = await export_incremental(args.out, args.format)
+            except RuntimeError as e:
+                print(f"❌ {e}")
+                return
+            print(f"✅ Инкрементальный экспорт в {args.out}: " + ", ".join(
+                f"{name} +{rows}" for name, rows in exported.items()
+            ))
+        else:
+            try:
+                await export_stats_to_csv(args.days, args.compress, args.archive)
+            except RuntimeError as e:
+                print(f"❌ {e}")
+    finally:
+        await close_db()
 
 
 if __name__ == "__main__":
-    export_stats_to_csv()
+    from config import ANALYTICS_EXPORT_DIR, ANALYTICS_EXPORT_FORMAT
+
+    parser = argparse.ArgumentParser(description="Экспорт аналитики")
+    parser.add_argument("--days", type=int, default=30, help="Окно данных по дням (дней)")
+    parser.add_argument(
+        "--compress", choices=sorted(COMPRESSION_SUFFIXES), default="none",
+        help="Сжатие CSV-файлов (zstd — нужен пакет zstandard)"
+    )
+    parser.add_argument("--archive", action="store_true", help="Все CSV-отчёты одним zip-архивом")
+    parser.add_argument(
+        "--incremental", action="store_true",
+        help="Дописать новые строки dice_throws и users в колоночные файлы вместо CSV"
+    )
+    parser.add_argument("--out", default=ANALYTICS_EXPORT_DIR, help="Каталог инкрементального экспорта")
+    parser.add_argument(
+        "--format", choices=["parquet", "arrow"], default=ANALYTICS_EXPORT_FORMAT,
+        help="Формат инкрементального экспорта"
+    )
+    asyncio.run(main(parser.parse_args()))
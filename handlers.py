@@ -5,32 +5,62 @@
 
 from aiogram import Bot, Dispatcher, Router, F
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
-from aiogram.filters import Command, StateFilter
+from aiogram.filters import Command, CommandObject, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import datetime, timedelta
+from typing import AsyncIterator, List, Optional, Tuple
+import asyncio
 import logging
 import random
 
 logger = logging.getLogger(__name__)
 
-from config import ADMIN_IDS
+from config import (
+    ADMIN_IDS, AI_STREAMING, STREAM_EDIT_INTERVAL, AI_COMBINED_READING,
+    AI_SPECULATIVE_PATHS, AI_SPECULATION_TIMEOUT
+)
 from database import (
-    get_or_create_user, update_last_interaction,
-    save_throw, update_throw, get_user_throws, get_stats, get_detailed_analytics
+    SessionLocal, get_or_create_user_id,
+    save_throw, get_user_throws_page, get_stats, get_detailed_analytics
 )
+from write_behind import throw_writes, interactions
+from middlewares import DbSessionMiddleware, LastInteractionMiddleware
 from dice_meanings import (
     get_all_symbols, get_symbol_info, format_symbol_info,
     get_combined_interpretation, STORY_PATHS, get_path_info,
     DICE_POSITIONS, get_position_info
 )
 from ai_client import (
-    generate_interpretation, generate_path_suggestions,
-    generate_reflection_prompts
+    generate_interpretation, stream_interpretation, generate_path_suggestions,
+    generate_reading, generate_reflection_prompts,
+    start_speculative_reflection_prompts, promote_speculative_reflection
 )
+from ai_metrics import metrics
+from analytics_engine import get_symbol_analytics, retention
 
 # Роутер
 router = Router()
 
+# Спекулятивные генерации вопросов, которые ещё выполняются: throw_id -> {path_key: Task}
+_speculations = {}
+
+# Попыток финальной правки стрима при 429 (каждая — после Retry-After)
+STREAM_FINAL_EDIT_ATTEMPTS = 3
+
+# Бросков на странице /history
+HISTORY_PAGE_SIZE = 5
+# Длина превью ситуации в /history
+HISTORY_PREVIEW_CHARS = 60
+
+# Самое длинное окно /analytics (дней): данные берутся из daily_stats
+ANALYTICS_MAX_DAYS = 365
+# Матрица удержания в /analytics: последних когорт и недель после первой
+RETENTION_COHORTS = 6
+RETENTION_PERIODS = 5
+
 # FSM States
 class ThrowState(StatesGroup):
     waiting_situation = State()
@@ -43,7 +73,7 @@ class ThrowState(StatesGroup):
 # ============================================
 
 @router.message(Command("start"))
-async def cmd_start(message: Message, state: FSMContext):
+async def cmd_start(message: Message, state: FSMContext, session: AsyncSession):
     """Команда /start - приветствие"""
     await state.clear()
 
@@ -52,7 +82,7 @@ async def cmd_start(message: Message, state: FSMContext):
     full_name = message.from_user.full_name
 
     # Создаем или получаем пользователя
-    get_or_create_user(user_id, username, full_name)
+    await get_or_create_user_id(session, user_id, username, full_name)
 
     welcome_text = """🎲 **Добро пожаловать в Dice of Isight!**
 
@@ -139,13 +169,15 @@ async def cmd_symbols(message: Message):
 
 
 @router.message(Command("history"))
-async def cmd_history(message: Message):
-    """Команда /history - история бросков"""
+async def cmd_history(message: Message, session: AsyncSession):
+    """Команда /history - история бросков (последние, дальше — кнопками)"""
     user_id = str(message.from_user.id)
 
-    throws = get_user_throws(user_id, limit=5)
+    rows, has_older = await get_user_throws_page(
+        session, user_id, limit=HISTORY_PAGE_SIZE, preview_chars=HISTORY_PREVIEW_CHARS
+    )
 
-    if not throws:
+    if not rows:
         await message.answer(
             "📜 У вас пока нет истории бросков.\n\n"
             "Начните с команды /throw",
@@ -153,12 +185,75 @@ async def cmd_history(message: Message):
         )
         return
 
-    text = "📜 **Ваши последние 5 бросков:**\n\n"
+    text, keyboard = render_history_page(
+        rows, has_older, has_newer=False,
+        title=f"📜 **Ваши последние {len(rows)} бросков:**"
+    )
+    await message.answer(text, reply_markup=keyboard, parse_mode="Markdown")
+
+
+@router.callback_query(F.data.startswith("hist:"))
+async def process_history_page(callback: CallbackQuery, session: AsyncSession):
+    """Листание /history: курсор (timestamp, id) хранится в callback_data"""
+    cursor = decode_history_cursor(callback.data)
+    if cursor is None:
+        await callback.answer()
+        return
+    direction, position = cursor
+
+    user_id = str(callback.from_user.id)
+    if direction == "older":
+        rows, has_older = await get_user_throws_page(
+            session, user_id, limit=HISTORY_PAGE_SIZE, before=position, preview_chars=HISTORY_PREVIEW_CHARS
+        )
+        has_newer = True
+    else:
+        rows, has_newer = await get_user_throws_page(
+            session, user_id, limit=HISTORY_PAGE_SIZE, after=position, preview_chars=HISTORY_PREVIEW_CHARS
+        )
+        has_older = True
+
+    if not rows:
+        await callback.answer("Больше бросков нет")
+        return
+
+    text, keyboard = render_history_page(rows, has_older, has_newer, title="📜 **История бросков:**")
+    try:
+        await callback.message.edit_text(text, reply_markup=keyboard, parse_mode="Markdown")
+    except TelegramBadRequest:
+        pass  # сообщение не изменилось (двойное нажатие)
+    await callback.answer()
+
+
+_CURSOR_EPOCH = datetime(1970, 1, 1)
+_CURSOR_DIRECTIONS = {"o": "older", "n": "newer"}
 
-    for i, throw in enumerate(throws, 1):
+
+def encode_history_cursor(direction: str, timestamp: datetime, throw_id: int) -> str:
+    """callback_data кнопки истории: hist:<o|n>:<микросекунды с эпохи>:<id>"""
+    micros = (timestamp - _CURSOR_EPOCH) // timedelta(microseconds=1)
+    return f"hist:{direction[0]}:{micros}:{throw_id}"
+
+
+def decode_history_cursor(data: str) -> Optional[Tuple[str, Tuple[datetime, int]]]:
+    """Разобрать callback_data кнопки истории; None — если данные испорчены"""
+    try:
+        _, direction, micros, throw_id = data.split(":")
+        timestamp = _CURSOR_EPOCH + timedelta(microseconds=int(micros))
+        return _CURSOR_DIRECTIONS[direction], (timestamp, int(throw_id))
+    except (ValueError, KeyError):
+        return None
+
+
+def render_history_page(rows: List, has_older: bool, has_newer: bool, title: str):
+    """Текст страницы истории и клавиатура «новее / старше»"""
+    text = f"{title}\n\n"
+
+    for i, throw in enumerate(rows, 1):
         timestamp = throw.timestamp.strftime("%d.%m.%Y %H:%M")
         text += f"**{i}. [{timestamp}]**\n"
-        text += f"_{throw.situation[:60]}{'...' if len(throw.situation) > 60 else ''}_\n"
+        situation = throw.situation
+        text += f"_{situation[:HISTORY_PREVIEW_CHARS]}{'...' if len(situation) > HISTORY_PREVIEW_CHARS else ''}_\n"
         text += f"🎲 {throw.symbol} {throw.archetype} {throw.emotion}\n"
 
         if throw.chosen_path:
@@ -167,11 +262,24 @@ async def cmd_history(message: Message):
 
         text += "\n"
 
-    await message.answer(text, parse_mode="Markdown")
+    buttons = []
+    if has_newer:
+        first = rows[0]
+        buttons.append(InlineKeyboardButton(
+            text="⬅️ Новее", callback_data=encode_history_cursor("newer", first.timestamp, first.id)
+        ))
+    if has_older:
+        last = rows[-1]
+        buttons.append(InlineKeyboardButton(
+            text="Старше ➡️", callback_data=encode_history_cursor("older", last.timestamp, last.id)
+        ))
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[buttons]) if buttons else None
+
+    return text, keyboard
 
 
 @router.message(Command("stats"))
-async def cmd_stats(message: Message):
+async def cmd_stats(message: Message, session: AsyncSession):
     """Команда /stats - статистика бота (только для админа)"""
     user_id_str = str(message.from_user.id)
     logger.info(f"🔍 /stats вызван пользователем: {user_id_str}, ADMIN_IDS: {ADMIN_IDS}")
@@ -179,7 +287,7 @@ async def cmd_stats(message: Message):
         await message.answer("⛔ Эта команда доступна только администратору")
         return
 
-    stats = get_stats()
+    stats = await get_stats(session)
 
     text = f"""📊 **Статистика бота:**
 
@@ -191,21 +299,72 @@ async def cmd_stats(message: Message):
 📈 Метрики:
 • Среднее бросков/пользователь: {stats['avg_throws_per_user']}
 • Процент завершения: {stats['completion_rate']}%
-
+{format_ai_summary()}
 _Dice of Isight помогает людям видеть по-новому_ ✨"""
 
     await message.answer(text, parse_mode="Markdown")
 
 
+def format_ai_summary() -> str:
+    """Блок телеметрии ИИ для /stats (с момента запуска процесса)"""
+    summary = metrics.summary()
+    if not summary["generators"]:
+        return ""
+
+    lines = ["", "🧠 ИИ (с момента запуска):"]
+    for generator, data in summary["generators"].items():
+        p50 = f"{data['p50']:.1f}" if data["p50"] is not None else "—"
+        p99 = f"{data['p99']:.1f}" if data["p99"] is not None else "—"
+        lines.append(
+            f"• {generator}: {data['calls']} выз., p50 {p50}с / p99 {p99}с, "
+            f"fallback {data['fallback_rate']}%, кэш {data['cache_hit_rate']}%"
+        )
+    lines.append(
+        f"• Токены: {summary['prompt_tokens']} вход / {summary['completion_tokens']} выход, "
+        f"~${summary['cost_usd']}"
+    )
+    lines.append(f"• Повторы запросов: {summary['retries']}")
+    return "\n".join(lines) + "\n"
+
+
+def render_retention_table(rows: List[dict]) -> str:
+    """
+    Моноширинная таблица когорт: неделя первого броска, размер и доля
+    вернувшихся через 1..N недель (неделя 0 — всегда 100%, не выводится)
+    """
+    if not rows:
+        return "  Нет данных"
+    header = "Неделя  Юзеров" + "".join(f"{'Н' + str(week):>5}" for week in range(1, RETENTION_PERIODS + 1))
+    lines = [header]
+    for row in rows:
+        cells = ""
+        for week in range(1, RETENTION_PERIODS + 1):
+            if week < len(row["retention"]):
+                cells += f"{row['retention'][week] * 100:>5.0f}"
+            else:
+                cells += f"{'—':>5}"
+        lines.append(f"{row['cohort'].strftime('%d.%m'):<6}{row['size']:>8}{cells}")
+    return "```\n" + "\n".join(lines) + "\n```"
+
+
 @router.message(Command("analytics"))
-async def cmd_analytics(message: Message):
-    """Команда /analytics - детальная аналитика (только для админа)"""
+async def cmd_analytics(message: Message, command: CommandObject, session: AsyncSession):
+    """Команда /analytics [дней] - детальная аналитика (только для админа)"""
     if str(message.from_user.id) not in ADMIN_IDS:
         await message.answer("⛔ Эта команда доступна только администратору")
         return
 
-    stats = get_stats()
-    analytics = get_detailed_analytics()
+    # Окно роста: /analytics 90, /analytics 365 (по умолчанию 30 дней)
+    days = 30
+    if command.args:
+        if not command.args.strip().isdigit() or not 1 <= int(command.args) <= ANALYTICS_MAX_DAYS:
+            await message.answer(f"Использование: /analytics [дней], от 1 до {ANALYTICS_MAX_DAYS}")
+            return
+        days = int(command.args)
+
+    stats = await get_stats(session)
+    analytics = await get_detailed_analytics(session, days)
+    await retention.refresh(session)
 
     # Форматируем пути
     path_text = ""
@@ -238,15 +397,57 @@ async def cmd_analytics(message: Message):
 **Популярные пути:**
 {path_text if path_text else "  Нет данных"}
 
-**Рост за 30 дней:**
+**Рост за {days} дн.:**
 • Новых юзеров: {sum(item['count'] for item in analytics['users_by_day'])}
 • Бросков: {sum(item['count'] for item in analytics['throws_by_day'])}
+• Завершено: {sum(item['count'] for item in analytics['completions_by_day'])}
+• Вернулись: {sum(item['count'] for item in analytics['returning_by_day'])}
+
+**Удержание по неделям (% когорты):**
+{render_retention_table(retention.table("week", RETENTION_COHORTS))}
 
 _Используйте эти данные для улучшения продукта_ 💡"""
 
     await message.answer(text, parse_mode="Markdown")
 
 
+@router.message(Command("correlations"))
+async def cmd_correlations(message: Message, session: AsyncSession):
+    """Команда /correlations - связи символов с выбором пути (только для админа)"""
+    if str(message.from_user.id) not in ADMIN_IDS:
+        await message.answer("⛔ Эта команда доступна только администратору")
+        return
+
+    analytics = await get_symbol_analytics(session)
+    if analytics.total == 0:
+        await message.answer("📭 Пока нет бросков для анализа")
+        return
+
+    text = f"🔗 **Символы и выбор пути** ({analytics.total} бросков)\n\n"
+
+    text += "**Символ на позиции → путь (во сколько раз чаще среднего):**\n"
+    correlations = analytics.top_path_correlations(limit=5)
+    for item in correlations:
+        position = get_position_info(item['position'])['title']
+        path_info = get_path_info(item['path'])
+        text += (
+            f"• {item['symbol']} в позиции «{position}» → {path_info['emoji']} {path_info['title']}: "
+            f"{item['probability'] * 100:.0f}% (×{item['lift']:.2f}, n={item['support']})\n"
+        )
+    if not correlations:
+        text += "  Мало данных\n"
+
+    text += "\n**Пары символов, с которыми бросок чаще бросают:**\n"
+    pairs = analytics.top_abandoned_pairs(limit=5)
+    for item in pairs:
+        first, second = item['symbols']
+        text += f"• {first} + {second}: {item['abandon_rate'] * 100:.0f}% брошено (n={item['support']})\n"
+    if not pairs:
+        text += "  Мало данных\n"
+
+    await message.answer(text, parse_mode="Markdown")
+
+
 # ============================================
 # DICE THROW FLOW
 # ============================================
@@ -286,7 +487,7 @@ async def cmd_cancel(message: Message, state: FSMContext):
 
 
 @router.message(ThrowState.waiting_situation)
-async def process_situation(message: Message, state: FSMContext):
+async def process_situation(message: Message, state: FSMContext, session: AsyncSession):
     """Обработка описания ситуации"""
     situation = message.text
     user_id = str(message.from_user.id)
@@ -305,7 +506,8 @@ async def process_situation(message: Message, state: FSMContext):
 
     # Сохраняем бросок в базу с 6 символами
     symbols_data = {pos: sym for pos, sym in zip(position_keys, symbols)}
-    throw = save_throw(
+    throw = await save_throw(
+        session,
         telegram_id=user_id,
         situation=situation,
         symbol=symbols[0],  # root
@@ -315,6 +517,9 @@ async def process_situation(message: Message, state: FSMContext):
         gift_symbol=symbols[4],  # дар
         step_symbol=symbols[5]  # шаг
     )
+    # Фиксируем до запросов к ИИ: открытая транзакция не должна держать
+    # блокировку записи (SQLite) на время генерации
+    await session.commit()
 
     # Сохраняем ID броска и все символы
     await state.update_data(
@@ -337,19 +542,41 @@ async def process_situation(message: Message, state: FSMContext):
 
     # Генерируем интерпретацию через ИИ
     await message.bot.send_chat_action(message.chat.id, "typing")
+    notify_queued = queue_notice(message)
 
     try:
-        interpretation = generate_interpretation(situation, symbols)
+        path_suggestions = None
+        streamed = False
+
+        if AI_COMBINED_READING:
+            # Интерпретация и пути одним запросом
+            reading = await generate_reading(situation, symbols, on_queued=notify_queued)
+            interpretation = reading["interpretation"]
+            path_suggestions = reading["paths"]
+        elif AI_STREAMING:
+            # Показываем интерпретацию по мере генерации в одном сообщении
+            interpretation = await stream_to_message(
+                message,
+                "🔮 **Интерпретация:**\n\n",
+                stream_interpretation(situation, symbols, on_queued=notify_queued)
+            )
+            streamed = True
+        else:
+            interpretation = await generate_interpretation(situation, symbols, on_queued=notify_queued)
 
         # Сохраняем интерпретацию
-        update_throw(throw.id, interpretation=interpretation)
+        throw_writes.stage(throw.id, interpretation=interpretation)
 
-        # Отправляем интерпретацию
-        await message.answer(f"🔮 **Интерпретация:**\n\n{interpretation}", parse_mode="Markdown")
+        if not streamed:
+            # Отправляем интерпретацию
+            await message.answer(f"🔮 **Интерпретация:**\n\n{interpretation}", parse_mode="Markdown")
 
-        # Генерируем варианты путей
-        await message.bot.send_chat_action(message.chat.id, "typing")
-        path_suggestions = generate_path_suggestions(situation, symbols, interpretation)
+        if path_suggestions is None:
+            # Генерируем варианты путей
+            await message.bot.send_chat_action(message.chat.id, "typing")
+            path_suggestions = await generate_path_suggestions(
+                situation, symbols, interpretation, on_queued=notify_queued
+            )
 
         # Сохраняем предложения путей
         await state.update_data(path_suggestions=path_suggestions)
@@ -366,6 +593,9 @@ async def process_situation(message: Message, state: FSMContext):
 
         await state.set_state(ThrowState.choosing_path)
 
+        # Пока пользователь выбирает, заранее готовим вопросы для рефлексии
+        start_reflection_speculation(state, throw.id, situation, symbols)
+
     except Exception as e:
         logging.error(f"Error in interpretation: {e}")
         await message.answer(
@@ -375,6 +605,175 @@ async def process_situation(message: Message, state: FSMContext):
         await state.clear()
 
 
+def queue_notice(message: Message):
+    """Колбэк для ai_client: один раз сообщить, что запрос ждёт в очереди к ИИ"""
+    sent = False
+
+    async def notify():
+        nonlocal sent
+        if sent:
+            return
+        sent = True
+        try:
+            await message.answer("⏳ Сейчас много запросов — вы в очереди, ответ будет через несколько секунд")
+        except Exception as e:
+            logger.warning(f"Queue notice failed: {e}")
+
+    return notify
+
+
+async def stream_to_message(message: Message, header: str, chunks: AsyncIterator[str]) -> str:
+    """
+    Вывести потоковый текст в одно сообщение через throttled edit_message_text
+
+    Промежуточные правки идут без разметки (незакрытый Markdown ломает
+    парсинг), не чаще STREAM_EDIT_INTERVAL. Финальная правка — с Markdown.
+
+    Returns:
+        str: итоговый текст (последнее значение из chunks)
+    """
+    sent = await message.answer(f"{header}_..._", parse_mode="Markdown")
+
+    text = ""
+    shown = None
+    next_edit_at = 0.0
+    loop = asyncio.get_running_loop()
+
+    async for text in chunks:
+        now = loop.time()
+        if now < next_edit_at:
+            continue
+
+        preview = f"{header}{text} ▌"
+        if preview == shown:
+            continue
+
+        next_edit_at = now + STREAM_EDIT_INTERVAL
+        try:
+            await sent.edit_text(preview, parse_mode=None)
+            shown = preview
+        except TelegramRetryAfter as e:
+            next_edit_at = now + e.retry_after
+        except TelegramBadRequest as e:
+            logger.warning(f"Stream edit skipped: {e}")
+
+    # Финальная правка тоже соблюдает интервал (и Retry-After последней правки)
+    delay = next_edit_at - loop.time()
+    if delay > 0:
+        await asyncio.sleep(delay)
+    await _edit_final(sent, f"{header}{text}")
+
+    return text
+
+
+async def _edit_final(sent: Message, final: str):
+    """
+    Финальная правка стрима: Markdown, при невалидной разметке — как есть
+
+    На 429 ждёт Retry-After и повторяет. Ошибка здесь не прерывает обработчик:
+    текст пользователь уже видел, а интерпретацию ещё нужно сохранить.
+    """
+    for parse_mode in ("Markdown", None):
+        for _ in range(STREAM_FINAL_EDIT_ATTEMPTS):
+            try:
+                await sent.edit_text(final, parse_mode=parse_mode)
+                return
+            except TelegramRetryAfter as e:
+                await asyncio.sleep(e.retry_after)
+            except TelegramBadRequest as e:
+                # Модель могла выдать невалидный Markdown — показываем как есть
+                logger.warning(f"Final stream edit failed ({parse_mode or 'plain'}): {e}")
+                break
+        else:
+            logger.warning(f"Final stream edit: still rate limited after {STREAM_FINAL_EDIT_ATTEMPTS} attempts")
+            return
+
+
+def start_reflection_speculation(state: FSMContext, throw_id: int, situation: str, symbols: list):
+    """Запустить фоновую генерацию вопросов для путей в рамках бюджета AI_SPECULATIVE_PATHS"""
+    path_keys = list(STORY_PATHS)[:AI_SPECULATIVE_PATHS]
+    if not path_keys:
+        return
+
+    tasks = start_speculative_reflection_prompts(situation, symbols, path_keys, throw_id)
+    _speculations[throw_id] = tasks
+    collector = asyncio.create_task(_collect_reflection_speculation(state, throw_id, tasks))
+    collector.add_done_callback(lambda _: _speculations.pop(throw_id, None))
+
+
+async def _collect_reflection_speculation(state: FSMContext, throw_id: int, tasks: dict) -> dict:
+    """Дождаться спекулятивных вопросов (не дольше AI_SPECULATION_TIMEOUT) и положить их в FSM data"""
+    _, pending = await asyncio.wait(tasks.values(), timeout=AI_SPECULATION_TIMEOUT)
+    for task in pending:
+        task.cancel()
+
+    # Неудавшиеся и отменённые пути не сохраняем: для них будет обычный запрос
+    prompts = {
+        path_key: task.result()
+        for path_key, task in tasks.items()
+        if task.done() and not task.cancelled() and task.exception() is None and task.result()
+    }
+    logger.info(
+        f"Speculation for throw {throw_id}: generated prompts for {len(prompts)} of {len(tasks)} paths"
+    )
+
+    # Пользователь мог уже выбрать путь или начать новый бросок
+    data = await state.get_data()
+    if data.get("throw_id") == throw_id:
+        await state.update_data(speculative_prompts=prompts)
+
+    return prompts
+
+
+async def take_speculative_prompts(state: FSMContext, throw_id: int, path_key: str):
+    """
+    Забрать заранее сгенерированные вопросы для выбранного пути
+
+    Если спекуляция ещё идёт, запросы для остальных путей отменяются, а запрос
+    выбранного пути, если он ещё ждёт слот, поднимается до приоритета
+    PRIORITY_FLOW_END — пользователь не ждёт в конце очереди.
+    Неиспользованные пути логируются для учёта затрат.
+
+    Returns:
+        list | None: вопросы или None, если готовых вопросов нет
+    """
+    data = await state.get_data()
+    prompts = data.get("speculative_prompts")
+
+    if prompts is None and throw_id in _speculations:
+        tasks = _speculations.pop(throw_id)
+        for key, task in tasks.items():
+            if key != path_key:
+                task.cancel()
+
+        task = tasks.get(path_key)
+        used = None
+        if task is not None:
+            promoted = promote_speculative_reflection(throw_id, path_key)
+            try:
+                used = await asyncio.shield(task)
+            except asyncio.CancelledError:
+                # Отменён по AI_SPECULATION_TIMEOUT, а не вместе с обработчиком
+                if not task.cancelled():
+                    raise
+            logger.info(
+                f"Speculation for throw {throw_id}: {'hit' if used else 'miss'} on '{path_key}' "
+                f"(in flight{', promoted' if promoted else ''}), cancelled {len(tasks) - 1}"
+            )
+        return used
+
+    if not prompts:
+        return None
+
+    used = prompts.get(path_key)
+    discarded = [key for key in prompts if key != path_key]
+    logger.info(
+        f"Speculation for throw {throw_id}: {'hit' if used else 'miss'} on '{path_key}', "
+        f"discarded {len(discarded)} ({', '.join(discarded) or '-'})"
+    )
+    return used
+
+
 def create_path_keyboard() -> InlineKeyboardMarkup:
     """Создать клавиатуру с выбором пути"""
     buttons = []
@@ -391,7 +790,7 @@ def create_path_keyboard() -> InlineKeyboardMarkup:
 
 
 @router.callback_query(F.data.startswith("path_"))
-async def process_path_choice(callback: CallbackQuery, state: FSMContext):
+async def process_path_choice(callback: CallbackQuery, state: FSMContext, session: AsyncSession):
     """Обработка выбора пути"""
     path_key = callback.data.split("_")[1]
     data = await state.get_data()
@@ -404,8 +803,8 @@ async def process_path_choice(callback: CallbackQuery, state: FSMContext):
         await callback.answer("Ошибка: бросок не найден")
         return
 
-    # Сохраняем выбранный путь
-    update_throw(throw_id, chosen_path=path_key)
+    # Сохраняем выбранный путь (запишется вместе с вопросами в конце)
+    throw_writes.stage(throw_id, chosen_path=path_key)
 
     path_info = get_path_info(path_key)
 
@@ -415,14 +814,18 @@ async def process_path_choice(callback: CallbackQuery, state: FSMContext):
         parse_mode="Markdown"
     )
 
-    # Генерируем вопросы для рефлексии
-    await callback.message.answer("_Генерирую вопросы для рефлексии..._", parse_mode="Markdown")
-
     try:
-        reflection_prompts = generate_reflection_prompts(situation, path_key, symbols)
+        reflection_prompts = await take_speculative_prompts(state, throw_id, path_key)
+
+        if reflection_prompts is None:
+            # Генерируем вопросы для рефлексии
+            await callback.message.answer("_Генерирую вопросы для рефлексии..._", parse_mode="Markdown")
+            reflection_prompts = await generate_reflection_prompts(
+                situation, path_key, symbols, on_queued=queue_notice(callback.message)
+            )
 
         # Сохраняем вопросы
-        update_throw(throw_id, reflection_prompts=reflection_prompts)
+        throw_writes.stage(throw_id, reflection_prompts=reflection_prompts)
 
         # Отправляем вопросы
         prompts_text = f"📝 **Вопросы для письменной рефлексии:**\n\n"
@@ -454,6 +857,9 @@ async def process_path_choice(callback: CallbackQuery, state: FSMContext):
     await state.clear()
     await callback.answer()
 
+    # Все изменения броска — одним UPDATE, коммит делает DbSessionMiddleware
+    await throw_writes.flush(session, throw_id)
+
 
 
 
@@ -463,5 +869,7 @@ async def process_path_choice(callback: CallbackQuery, state: FSMContext):
 
 def register_handlers(dp: Dispatcher, bot: Bot):
     """Регистрация всех обработчиков"""
+    dp.update.middleware(LastInteractionMiddleware(interactions))
+    dp.update.middleware(DbSessionMiddleware(SessionLocal))
     dp.include_router(router)
     logging.info("✅ Обработчики зарегистрированы")
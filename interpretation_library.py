@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# interpretation_library.py - Precomputed interpretation library
+"""
+Офлайн-библиотека фрагментов интерпретаций для быстрых fallback-ответов
+
+Для каждого символа хранится фраза для каждой из 6 позиций (DICE_POSITIONS),
+строка "напряжения" и вопрос. Из них собирается интерпретация в том же
+формате, что отдаёт ИИ (Напряжение / Что видно / Вопрос).
+
+Библиотека хранится в gzip-сжатом JSON (INTERPRETATION_LIBRARY_PATH).
+
+Сборка:
+    python interpretation_library.py build            # через OpenAI
+    python interpretation_library.py build --offline  # из dice_meanings.py, без API
+"""
+
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import re
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from config import INTERPRETATION_LIBRARY_PATH, AI_MODEL
+from dice_meanings import BASIC_SYMBOLS, DICE_POSITIONS
+
+LIBRARY_VERSION = 1
+
+# Загруженная библиотека: {symbol: {"tension", "question", "positions": {pos: text}}}
+_library: Optional[Dict[str, Dict]] = None
+
+
+# ===================================
+# RUNTIME
+# ===================================
+
+def load_library(path: str = INTERPRETATION_LIBRARY_PATH) -> Dict[str, Dict]:
+    """Загрузить библиотеку с диска (один раз). Пустой dict, если файла нет"""
+    global _library
+    if _library is not None:
+        return _library
+
+    _library = {}
+    if not os.path.exists(path):
+        return _library
+
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") == LIBRARY_VERSION:
+            _library = data["symbols"]
+            print(f"[✅] Библиотека интерпретаций загружена: {len(_library)} символов")
+        else:
+            print(f"[⚠️] Библиотека интерпретаций {path}: неподдерживаемая версия")
+    except Exception as e:
+        print(f"[❌] Ошибка загрузки библиотеки интерпретаций: {e}")
+
+    return _library
+
+
+def compose_interpretation(symbols: List[str]) -> Optional[str]:
+    """
+    Собрать интерпретацию из библиотеки для расклада из 6 символов
+
+    Returns:
+        str | None: текст или None, если библиотеки нет или символа в ней нет
+    """
+    library = load_library()
+    if len(symbols) < 6:
+        return None
+
+    root, shadow, step = (library.get(symbols[i]) for i in (0, 3, 5))
+    if not (root and shadow and step):
+        return None
+
+    return f"""**Напряжение:**
+{root['tension']}
+
+**Что видно:**
+- Корень: {symbols[0]} — {root['positions']['root']}
+- Тень: {symbols[3]} — {shadow['positions']['shadow']}
+- Шаг: {symbols[5]} — {step['positions']['step']}
+
+**Вопрос:**
+{step['question']}"""
+
+
+# ===================================
+# BUILD
+# ===================================
+
+def _first_clause(text: str, max_words: int = 8) -> str:
+    """Первая часть фразы до запятой/точки с запятой, не длиннее max_words"""
+    clause = re.split(r"[,;:.(]", text, maxsplit=1)[0].replace('"', "").strip()
+    words = clause.split()[:max_words]
+    clause = " ".join(words)
+    return clause[:1].lower() + clause[1:]
+
+
+def build_offline_entry(symbol: str) -> Dict:
+    """Фрагменты для символа из данных dice_meanings.py, без обращения к API"""
+    info = BASIC_SYMBOLS[symbol]
+    light = _first_clause(info["light"])
+    shadow = _first_clause(info["shadow"])
+    archetype = _first_clause(info["archetype"])
+
+    return {
+        "tension": f"{shadow[:1].upper()}{shadow[1:]} — и это держит ситуацию на месте. "
+                   f"Тема: {info['keyword'].lower()}.",
+        "question": min(info["questions"], key=len),
+        "positions": {
+            "root": archetype,
+            "outer": light,
+            "inner": shadow,
+            "shadow": shadow,
+            "gift": light,
+            "step": light,
+        }
+    }
+
+
+LIBRARY_SYSTEM_PROMPT = """Ты пишешь фрагменты для символических интерпретаций.
+
+Для одного символа верни JSON:
+{"tension": "...", "question": "...", "positions": {"root": "...", "outer": "...", "inner": "...", "shadow": "...", "gift": "...", "step": "..."}}
+
+- positions: для каждой позиции — констатация в 5-8 словах, БЕЗ директив и советов
+- tension: 2 предложения — суть конфликта, только констатация
+- question: один провокационный вопрос, максимум 10 слов
+
+Запрещены слова "важно", "нужно", "стоит", "следует", "попробуй", "найди" и поэзия.
+Тон: прямой, честный, как умный друг."""
+
+
+async def build_ai_entry(symbol: str) -> Dict:
+    """Фрагменты для символа через OpenAI (один JSON-запрос на символ)"""
+    from ai_client import client
+
+    info = BASIC_SYMBOLS[symbol]
+    positions = "\n".join(
+        f"- {key} ({pos['title']}): {pos['description']}" for key, pos in DICE_POSITIONS.items()
+    )
+    user_prompt = f"""Символ: {symbol} {info['name']} ({info['keyword']})
+Архетип: {info['archetype']}
+Значение: {info['meaning']}
+Свет/Тень: {info['light']} / {info['shadow']}
+
+Позиции:
+{positions}"""
+
+    response = await client.chat.completions.create(
+        model=AI_MODEL,
+        messages=[
+            {"role": "system", "content": LIBRARY_SYSTEM_PROMPT},
+            {"role": "user", "content": user_prompt}
+        ],
+        temperature=0.6,
+        max_tokens=400,
+        response_format={"type": "json_object"}
+    )
+    entry = json.loads(response.choices[0].message.content)
+
+    # Недостающие части берём из офлайн-варианта
+    fallback = build_offline_entry(symbol)
+    return {
+        "tension": entry.get("tension") or fallback["tension"],
+        "question": entry.get("question") or fallback["question"],
+        "positions": {
+            key: (entry.get("positions") or {}).get(key) or fallback["positions"][key]
+            for key in DICE_POSITIONS
+        }
+    }
+
+
+async def build_library(offline: bool = False, path: str = INTERPRETATION_LIBRARY_PATH):
+    """Сгенерировать библиотеку для всех символов BASIC_SYMBOLS и записать на диск"""
+    symbols = list(BASIC_SYMBOLS)
+
+    if offline:
+        entries = [build_offline_entry(s) for s in symbols]
+    else:
+        entries = await asyncio.gather(*[build_ai_entry(s) for s in symbols])
+
+    data = {
+        "version": LIBRARY_VERSION,
+        "source": "offline" if offline else AI_MODEL,
+        "generated_at": datetime.utcnow().isoformat(),
+        "symbols": dict(zip(symbols, entries))
+    }
+
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+
+    print(f"✅ Библиотека интерпретаций записана: {path} ({os.path.getsize(path)} байт, {len(symbols)} символов)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Библиотека интерпретаций")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="Сгенерировать библиотеку")
+    build.add_argument("--offline", action="store_true", help="Без OpenAI, из dice_meanings.py")
+    build.add_argument("--out", default=INTERPRETATION_LIBRARY_PATH, help="Путь к файлу библиотеки")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        asyncio.run(build_library(offline=args.offline, path=args.out))
@@ -6,6 +6,7 @@
 """
 
 import asyncio
+import hmac
 import logging
 import sys
 import os
@@ -16,7 +17,7 @@ from aiogram.enums import ParseMode
 from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 from aiohttp import web
 
-from config import BOT_TOKEN
+from config import BOT_TOKEN, METRICS_PORT, METRICS_HOST, METRICS_TOKEN
 
 # Настройка логирования
 logging.basicConfig(
@@ -45,10 +46,47 @@ storage = MemoryStorage()
 dp = Dispatcher(storage=storage)
 
 
+async def metrics_handler(request: web.Request) -> web.Response:
+    """GET /metrics - телеметрия ИИ в формате Prometheus"""
+    if METRICS_TOKEN:
+        authorization = request.headers.get("Authorization", "")
+        if not hmac.compare_digest(authorization, f"Bearer {METRICS_TOKEN}"):
+            raise web.HTTPUnauthorized()
+
+    from ai_client import ai_gauges
+    from ai_metrics import metrics
+    return web.Response(text=metrics.render_prometheus(ai_gauges()), content_type="text/plain")
+
+
+async def start_metrics_server() -> web.AppRunner:
+    """
+    Отдельный внутренний сервер /metrics (в обоих режимах)
+
+    На публичный webhook-сервер метрики не выставляются: в них число
+    пользователей, стоимость и задержки ИИ.
+    """
+    app = web.Application()
+    app.router.add_get("/metrics", metrics_handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, METRICS_HOST, METRICS_PORT).start()
+    logger.info(f"📈 Метрики доступны на {METRICS_HOST}:{METRICS_PORT}/metrics")
+    return runner
+
+
 async def on_startup():
     """Действия при запуске бота"""
     logger.info("🎲 Dice of Isight Bot запускается...")
 
+    # Таблицы базы данных
+    from database import init_db
+    await init_db()
+
+    # Фоновая запись изменений брошенных бросков и отметок активности
+    from write_behind import throw_writes, interactions
+    throw_writes.start()
+    interactions.start()
+
     # Регистрация обработчиков
     try:
         from handlers import register_handlers
@@ -58,6 +96,11 @@ async def on_startup():
         logger.error(f"❌ Ошибка регистрации обработчиков: {e}")
         raise
 
+    # Прогрев соединений с OpenAI
+    from ai_client import warm_up_ai_client
+    if await warm_up_ai_client():
+        logger.info("✅ Соединения с OpenAI прогреты")
+
     # Установка webhook
     if WEBHOOK_HOST:
         await bot.set_webhook(
@@ -76,6 +119,20 @@ async def on_shutdown():
     logger.info("🛑 Остановка бота...")
     await bot.delete_webhook(drop_pending_updates=True)
     await bot.session.close()
+
+    from ai_client import close_ai_client
+    await close_ai_client()
+
+    # Незаписанные изменения бросков и отметки активности — до закрытия пула
+    from write_behind import throw_writes, interactions
+    for buffer in (throw_writes, interactions):
+        try:
+            await buffer.stop()
+        except Exception as e:
+            logger.error(f"❌ Не удалось записать буфер {type(buffer).__name__}: {e}")
+
+    from database import close_db
+    await close_db()
     logger.info("✅ Бот остановлен")
 
 
@@ -84,6 +141,7 @@ async def main():
     dp.startup.register(on_startup)
     dp.shutdown.register(on_shutdown)
 
+    metrics_runner = await start_metrics_server() if METRICS_PORT else None
     try:
         if WEBHOOK_HOST:
             # Webhook режим для Render
@@ -118,6 +176,8 @@ async def main():
         logger.exception(f"❌ Критическая ошибка: {e}")
         raise
     finally:
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
         await on_shutdown()
 
 
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# manage.py - Maintenance commands
+"""
+Служебные команды для базы данных бота
+
+Использование:
+    python manage.py migrate                         # применить миграции схемы
+    python manage.py reconcile-counters              # пересчитать stats_counters из таблиц
+    python manage.py backfill-rollups                # пересобрать daily_stats целиком
+    python manage.py backfill-rollups --since 2024-01-01   # только дни начиная с даты
+"""
+
+import argparse
+import asyncio
+from datetime import date
+
+from database import SessionLocal, engine, close_db, init_db, reconcile_counters, backfill_daily_stats
+from migrations import MIGRATIONS, applied_versions, migrate
+
+
+async def cmd_migrate(args: argparse.Namespace):
+    """Применить недостающие миграции и показать состояние схемы"""
+    await migrate(engine)
+    applied = set(await applied_versions(engine))
+
+    print("📋 Миграции:")
+    for migration in MIGRATIONS:
+        mark = "✅" if migration.version in applied else "⏳"
+        print(f"   {mark} {migration.version}: {migration.name}")
+
+
+async def cmd_reconcile_counters(args: argparse.Namespace):
+    """Пересобрать счётчики статистики из users и dice_throws"""
+    async with SessionLocal() as session:
+        counters = await reconcile_counters(session)
+        await session.commit()
+
+    print("✅ Счётчики пересчитаны:")
+    for name, value in sorted(counters.items()):
+        print(f"   {name}: {value}")
+
+
+async def cmd_backfill_rollups(args: argparse.Namespace):
+    """Пересчитать дневные срезы daily_stats из users и dice_throws"""
+    async with SessionLocal() as session:
+        days = await backfill_daily_stats(session, since=args.since)
+        await session.commit()
+
+    scope = f"начиная с {args.since}" if args.since else "за всё время"
+    print(f"✅ Дневные срезы пересчитаны {scope}: {days} дн.")
+
+
+COMMANDS = {
+    "migrate": cmd_migrate,
+    "reconcile-counters": cmd_reconcile_counters,
+    "backfill-rollups": cmd_backfill_rollups,
+}
+
+
+async def main(args: argparse.Namespace):
+    try:
+        await init_db()
+        await COMMANDS[args.command](args)
+    finally:
+        await close_db()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Служебные команды Dice of Isight Bot")
+    parser.add_argument("command", choices=sorted(COMMANDS), help="Команда")
+    parser.add_argument(
+        "--since", type=date.fromisoformat, default=None,
+        help="backfill-rollups: пересчитать дни начиная с даты (YYYY-MM-DD)"
+    )
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,59 @@
+# middlewares.py - aiogram middlewares
+"""
+Middleware для Dice of Isight Bot
+
+DbSessionMiddleware открывает одну сессию базы данных на апдейт и передаёт
+её обработчикам аргументом `session`. После успешной обработки транзакция
+коммитится, при исключении — откатывается.
+
+Сессия ленивая: соединение берётся из пула только при первом запросе,
+апдейты без обращений к базе ничего не стоят.
+
+LastInteractionMiddleware отмечает активность пользователя в буфере
+write_behind.interactions — в базу она попадает пачкой, не на каждое сообщение.
+"""
+
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from write_behind import LastInteractionBuffer
+
+
+class DbSessionMiddleware(BaseMiddleware):
+    """Unit of work: одна сессия и транзакция на апдейт"""
+
+    def __init__(self, session_factory: async_sessionmaker):
+        self.session_factory = session_factory
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        async with self.session_factory() as session:
+            data["session"] = session
+            result = await handler(event, data)
+            await session.commit()
+            return result
+
+
+class LastInteractionMiddleware(BaseMiddleware):
+    """Отметка last_interaction для автора апдейта (без запроса к базе)"""
+
+    def __init__(self, buffer: LastInteractionBuffer):
+        self.buffer = buffer
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is not None:
+            self.buffer.touch(str(user.id))
+        return await handler(event, data)
@@ -0,0 +1,157 @@
+# migrations.py - Versioned schema migrations
+"""
+Версионные миграции схемы базы данных
+
+create_all создаёт только недостающие таблицы: индекс или столбец,
+добавленный в модель позже, в существующую базу так не попадёт.
+Поэтому изменения схемы оформляются миграциями:
+
+- каждая миграция — номер версии, название и корутина, получающая соединение;
+- применённые версии записываются в таблицу schema_version;
+- migrate() выполняет недостающие миграции по порядку, каждую в своей
+  транзакции вместе с записью в schema_version.
+
+Миграции запускаются при старте (init_db) и вручную: python manage.py migrate.
+Новую миграцию добавляют в конец MIGRATIONS со следующим номером; уже
+выпущенные миграции не меняют. SQL пишется так, чтобы работать и в SQLite,
+и в PostgreSQL (IF NOT EXISTS — и на базах, где объект уже есть).
+"""
+
+from datetime import datetime
+from typing import Awaitable, Callable, List, NamedTuple
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, inspect, select, text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from symbol_registry import pack_layout
+
+metadata = MetaData()
+
+schema_version = Table(
+    "schema_version",
+    metadata,
+    Column("version", Integer, primary_key=True),
+    Column("name", String, nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    apply: Callable[[AsyncConnection], Awaitable[None]]
+
+
+# ===================================
+# MIGRATIONS
+# ===================================
+
+async def _throws_user_timestamp_index(conn: AsyncConnection):
+    # get_user_throws: броски пользователя от новых к старым
+    await conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_dice_throws_user_id_timestamp "
+        "ON dice_throws (user_id, timestamp DESC)"
+    ))
+
+
+async def _throws_completed_index(conn: AsyncConnection):
+    # Завершённые броски (пути, пересчёт счётчиков): незавершённые в индекс не попадают
+    await conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_dice_throws_chosen_path_completed "
+        "ON dice_throws (chosen_path) WHERE chosen_path IS NOT NULL"
+    ))
+
+
+async def _users_last_interaction_index(conn: AsyncConnection):
+    # Активные за 7 дней в /stats
+    await conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_users_last_interaction "
+        "ON users (last_interaction)"
+    ))
+
+
+async def _throws_history_keyset_index(conn: AsyncConnection):
+    # Keyset-пагинация /history сортирует по (timestamp, id): с id в индексе
+    # страница читается прямо из индекса, без досортировки. Индекс
+    # миграции 1 — его префикс, он больше не нужен
+    await conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_dice_throws_user_id_timestamp_id "
+        "ON dice_throws (user_id, timestamp DESC, id DESC)"
+    ))
+    await conn.execute(text("DROP INDEX IF EXISTS ix_dice_throws_user_id_timestamp"))
+
+
+# Строк за один проход заполнения столбца
+BACKFILL_BATCH_SIZE = 1000
+
+
+async def _column_exists(conn: AsyncConnection, table: str, column: str) -> bool:
+    columns = await conn.run_sync(lambda sync_conn: inspect(sync_conn).get_columns(table))
+    return any(item["name"] == column for item in columns)
+
+
+async def _throws_layout_column(conn: AsyncConnection):
+    # Упакованный расклад (symbol_registry): столбец есть у баз, созданных
+    # create_all после его появления в модели
+    if not await _column_exists(conn, "dice_throws", "layout"):
+        await conn.execute(text("ALTER TABLE dice_throws ADD COLUMN layout INTEGER"))
+
+    # Заполняем историю пачками по id
+    last_id = 0
+    while True:
+        rows = (await conn.execute(text(
+            "SELECT id, symbol, archetype, emotion, shadow_symbol, gift_symbol, step_symbol "
+            "FROM dice_throws WHERE id > :last_id AND layout IS NULL ORDER BY id LIMIT :limit"
+        ), {"last_id": last_id, "limit": BACKFILL_BATCH_SIZE})).all()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+
+        updates = []
+        for row in rows:
+            layout = pack_layout(row[1:])
+            if layout is not None:
+                updates.append({"throw_id": row[0], "layout": layout})
+        if updates:
+            await conn.execute(
+                text("UPDATE dice_throws SET layout = :layout WHERE id = :throw_id"), updates
+            )
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "dice_throws (user_id, timestamp DESC) index", _throws_user_timestamp_index),
+    Migration(2, "partial index on completed dice_throws", _throws_completed_index),
+    Migration(3, "users.last_interaction index", _users_last_interaction_index),
+    Migration(4, "dice_throws (user_id, timestamp DESC, id DESC) index", _throws_history_keyset_index),
+    Migration(5, "dice_throws.layout packed symbols", _throws_layout_column),
+]
+
+
+# ===================================
+# RUNNER
+# ===================================
+
+async def applied_versions(engine: AsyncEngine) -> List[int]:
+    """Номера применённых миграций"""
+    async with engine.begin() as conn:
+        await conn.run_sync(metadata.create_all)
+        result = await conn.execute(select(schema_version.c.version).order_by(schema_version.c.version))
+        return [version for (version,) in result.all()]
+
+
+async def migrate(engine: AsyncEngine) -> List[Migration]:
+    """Применить недостающие миграции по порядку. Возвращает применённые сейчас"""
+    applied = set(await applied_versions(engine))
+    pending = [migration for migration in MIGRATIONS if migration.version not in applied]
+
+    for migration in pending:
+        async with engine.begin() as conn:
+            await migration.apply(conn)
+            await conn.execute(schema_version.insert().values(
+                version=migration.version,
+                name=migration.name,
+                applied_at=datetime.utcnow()
+            ))
+        print(f"✅ Миграция {migration.version}: {migration.name}")
+
+    return pending
@@ -0,0 +1,102 @@
+# storage.py - Storage profiles for the database engine
+"""
+Профили хранилища: параметры движка SQLAlchemy под конкретный бэкенд
+
+- SQLite: WAL (читатели не блокируются писателем), synchronous=NORMAL,
+  busy_timeout, mmap_size и cache_size — применяются на каждое новое соединение;
+  небольшой пул постоянных соединений вместо нового соединения на каждую сессию;
+- PostgreSQL: размер пула, pool_pre_ping (мёртвые соединения после
+  рестарта базы не доходят до обработчиков) и pool_recycle.
+
+DB_TUNING=false — движок с настройками SQLAlchemy по умолчанию
+(для сравнения в benchmark_db.py).
+"""
+
+from typing import Any, Dict
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from config import (
+    DB_TUNING, DB_SQLITE_WAL, DB_SQLITE_SYNCHRONOUS, DB_SQLITE_BUSY_TIMEOUT,
+    DB_SQLITE_MMAP_SIZE, DB_SQLITE_CACHE_SIZE, DB_SQLITE_POOL_SIZE,
+    DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_RECYCLE
+)
+
+
+def async_database_url(url: str) -> str:
+    """URL с асинхронным драйвером: sqlite → aiosqlite, postgresql → asyncpg"""
+    if url.startswith("sqlite:"):
+        return "sqlite+aiosqlite:" + url[len("sqlite:"):]
+    for prefix in ("postgresql:", "postgres:"):
+        if url.startswith(prefix):
+            return "postgresql+asyncpg:" + url[len(prefix):]
+    return url
+
+
+def backend_name(url: str) -> str:
+    """sqlite / postgresql / имя другого диалекта"""
+    return make_url(async_database_url(url)).get_backend_name()
+
+
+def _is_memory_sqlite(url: str) -> bool:
+    return make_url(url).database in (None, "", ":memory:")
+
+
+def sqlite_pragmas(url: str) -> Dict[str, Any]:
+    """Pragma для нового соединения SQLite"""
+    pragmas = {
+        "busy_timeout": DB_SQLITE_BUSY_TIMEOUT,
+        "cache_size": DB_SQLITE_CACHE_SIZE,
+    }
+    if not _is_memory_sqlite(url):
+        if DB_SQLITE_WAL:
+            pragmas["journal_mode"] = "WAL"
+        pragmas["synchronous"] = DB_SQLITE_SYNCHRONOUS
+        pragmas["mmap_size"] = DB_SQLITE_MMAP_SIZE
+    return pragmas
+
+
+def engine_options(url: str, tuned: bool = DB_TUNING) -> Dict[str, Any]:
+    """Аргументы create_async_engine для бэкенда"""
+    if not tuned:
+        return {}
+
+    backend = backend_name(url)
+    if backend == "postgresql":
+        return {
+            "pool_size": DB_POOL_SIZE,
+            "max_overflow": DB_MAX_OVERFLOW,
+            "pool_pre_ping": True,
+            "pool_recycle": DB_POOL_RECYCLE,
+        }
+    if backend == "sqlite" and not _is_memory_sqlite(url):
+        return {
+            "poolclass": AsyncAdaptedQueuePool,
+            "pool_size": DB_SQLITE_POOL_SIZE,
+            "max_overflow": 0,
+        }
+    return {}
+
+
+def _install_sqlite_pragmas(sync_engine: Engine, url: str):
+    """Выполнять pragma при каждом новом соединении пула"""
+    pragmas = sqlite_pragmas(url)
+
+    @event.listens_for(sync_engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+
+def create_storage_engine(url: str, tuned: bool = DB_TUNING) -> AsyncEngine:
+    """Асинхронный движок с профилем хранилища для DATABASE_URL"""
+    engine = create_async_engine(async_database_url(url), echo=False, **engine_options(url, tuned))
+    if tuned and backend_name(url) == "sqlite":
+        _install_sqlite_pragmas(engine.sync_engine, url)
+    return engine
+
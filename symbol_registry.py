@@ -0,0 +1,76 @@
+# symbol_registry.py - Stable integer IDs for dice symbols and packed layouts
+"""
+Реестр символов: постоянные числовые ID для BASIC_SYMBOLS
+
+Расклад из шести символов упаковывается в одно целое (dice_throws.layout):
+по 4 бита на позицию, позиция i (порядок DICE_POSITIONS: root, outer, inner,
+shadow, gift, step) занимает биты 4*i .. 4*i+3. analytics_engine.py читает
+только этот столбец и считает частоты и совпадения символов по позициям
+сдвигами и масками в NumPy, без сравнения строк с эмодзи в шести столбцах.
+
+ID закреплены списком SYMBOL_ORDER, а не порядком словаря BASIC_SYMBOLS:
+переставлять и удалять элементы списка нельзя — это сломает уже
+записанные layout. В 4 бита помещается 16 символов; для наборов Action и
+Adventure понадобится новый столбец с большей шириной.
+"""
+
+from typing import Dict, List, Optional, Sequence
+
+from dice_meanings import BASIC_SYMBOLS, DICE_POSITIONS
+
+# Бит на позицию и число позиций в раскладе
+LAYOUT_BITS = 4
+LAYOUT_POSITIONS = len(DICE_POSITIONS)
+_MASK = (1 << LAYOUT_BITS) - 1
+
+# Символы в порядке ID: 0, 1, 2, ...
+SYMBOL_ORDER = (
+    "🔍", "🌸", "🪐", "➡️", "💭", "⛲", "🧲", "🌳",
+    "🕊️", "💧", "✏️", "🐾", "✉️", "🎩", "👓", "📧",
+)
+
+SYMBOL_IDS: Dict[str, int] = {symbol: symbol_id for symbol_id, symbol in enumerate(SYMBOL_ORDER)}
+
+# Реестр обязан покрывать базовый набор и помещаться в LAYOUT_BITS
+if set(SYMBOL_IDS) != set(BASIC_SYMBOLS):
+    raise ValueError("SYMBOL_ORDER не совпадает с BASIC_SYMBOLS")
+if len(SYMBOL_ORDER) > _MASK + 1:
+    raise ValueError("Символы не помещаются в LAYOUT_BITS")
+
+
+def symbol_id(symbol: str) -> Optional[int]:
+    """ID символа или None для неизвестного"""
+    return SYMBOL_IDS.get(symbol)
+
+
+def symbol_by_id(symbol_id: int) -> str:
+    """Символ по ID"""
+    return SYMBOL_ORDER[symbol_id]
+
+
+def pack_layout(symbols: Sequence[Optional[str]]) -> Optional[int]:
+    """
+    Упаковать расклад из шести символов в целое
+
+    None — если символов не шесть или среди них есть неизвестный
+    (старые броски из трёх символов): пустой позиции в 4 битах не выразить.
+    """
+    if len(symbols) != LAYOUT_POSITIONS:
+        return None
+    layout = 0
+    for position, symbol in enumerate(symbols):
+        symbol_id = SYMBOL_IDS.get(symbol)
+        if symbol_id is None:
+            return None
+        layout |= symbol_id << (LAYOUT_BITS * position)
+    return layout
+
+
+def unpack_layout(layout: int) -> List[str]:
+    """Расклад из упакованного целого"""
+    return [SYMBOL_ORDER[symbol_id_at(layout, position)] for position in range(LAYOUT_POSITIONS)]
+
+
+def symbol_id_at(layout: int, position: int) -> int:
+    """ID символа на позиции"""
+    return (layout >> (LAYOUT_BITS * position)) & _MASK
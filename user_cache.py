@@ -0,0 +1,52 @@
+# user_cache.py - In-process telegram_id -> users.id cache
+"""
+Кэш идентификаторов пользователей
+
+save_throw и /start каждый раз искали пользователя по users.telegram_id.
+Соответствие telegram_id -> users.id не меняется, поэтому после первого
+поиска оно хранится в ограниченном LRU-кэше процесса.
+
+В кэш попадают только пользователи, найденные SELECT'ом (уже закоммиченные):
+только что созданный пользователь может исчезнуть при откате транзакции.
+"""
+
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from config import USER_ID_CACHE_SIZE
+
+
+class UserIdCache:
+    """LRU: telegram_id -> users.id"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._ids: "OrderedDict[str, int]" = OrderedDict()
+        self.counters = {"hits": 0, "misses": 0}
+
+    def get(self, telegram_id: str) -> Optional[int]:
+        user_id = self._ids.get(telegram_id)
+        if user_id is None:
+            self.counters["misses"] += 1
+            return None
+        self._ids.move_to_end(telegram_id)
+        self.counters["hits"] += 1
+        return user_id
+
+    def set(self, telegram_id: str, user_id: int):
+        if self.max_entries <= 0:
+            return
+        self._ids[telegram_id] = user_id
+        self._ids.move_to_end(telegram_id)
+        while len(self._ids) > self.max_entries:
+            self._ids.popitem(last=False)
+
+    def discard(self, telegram_id: str):
+        self._ids.pop(telegram_id, None)
+
+    def stats(self) -> Dict[str, int]:
+        return {"size": len(self._ids), **self.counters}
+
+
+# Общий кэш процесса
+user_ids = UserIdCache(USER_ID_CACHE_SIZE)
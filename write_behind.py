@@ -0,0 +1,204 @@
+# write_behind.py - Write-behind buffers for throw updates and user activity
+"""
+Отложенная запись в базу
+
+ThrowWriteBuffer — изменения броска. За один бросок обработчики меняют
+запись до трёх раз (интерпретация, выбранный путь, вопросы для рефлексии).
+Вместо UPDATE + коммита на каждое изменение поля копятся в памяти по
+throw_id и записываются одним UPDATE:
+- в конце потока (выбор пути) — в сессии апдейта, коммит делает middleware;
+- брошенные потоки — фоновой задачей через THROW_WRITE_DELAY секунд;
+- при остановке бота — всё, что осталось (flush_all из on_shutdown).
+
+LastInteractionBuffer — users.last_interaction. Каждое сообщение только
+отмечает пользователя в памяти; раз в LAST_INTERACTION_FLUSH_INTERVAL
+секунд все отметки пишутся одним пакетным UPDATE.
+"""
+
+import asyncio
+import logging
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from config import THROW_WRITE_DELAY, LAST_INTERACTION_FLUSH_INTERVAL
+from database import SessionLocal, update_throw, update_last_interactions
+
+logger = logging.getLogger(__name__)
+
+# Как часто фоновая задача ищет просроченные записи (сек)
+FLUSH_CHECK_INTERVAL = 5
+
+
+class _Pending:
+    __slots__ = ("fields", "staged_at")
+
+    def __init__(self):
+        self.fields: Dict[str, Any] = {}
+        self.staged_at = time.monotonic()
+
+
+class _PeriodicFlusher(ABC):
+    """Фоновая задача, которая периодически вызывает _flush_due()"""
+
+    check_interval: float = FLUSH_CHECK_INTERVAL
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+
+    @abstractmethod
+    async def _flush_due(self):
+        """Записать то, что пора записать (вызывается фоновой задачей)"""
+
+    @abstractmethod
+    async def flush_all(self):
+        """Записать всё накопленное (при остановке)"""
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.check_interval)
+            try:
+                await self._flush_due()
+            except Exception:
+                pass  # уже залогировано, повторим на следующем проходе
+
+    def start(self):
+        """Запустить фоновую запись"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Остановить фоновую задачу и записать всё, что осталось"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush_all()
+
+
+class ThrowWriteBuffer(_PeriodicFlusher):
+    """Буфер изменений бросков: throw_id -> поля для одного UPDATE"""
+
+    def __init__(self, session_factory: async_sessionmaker, flush_delay: float):
+        super().__init__()
+        self.session_factory = session_factory
+        self.flush_delay = flush_delay
+        self._pending: Dict[int, _Pending] = {}
+
+        self.counters = {"staged": 0, "flushed_updates": 0, "flush_failures": 0}
+
+    def stage(
+        self,
+        throw_id: int,
+        interpretation: str = None,
+        chosen_path: str = None,
+        reflection_prompts: List[str] = None
+    ):
+        """Запомнить изменения броска (пустые значения, как и в update_throw, не пишутся)"""
+        fields = {
+            "interpretation": interpretation,
+            "chosen_path": chosen_path,
+            "reflection_prompts": reflection_prompts,
+        }
+        pending = self._pending.setdefault(throw_id, _Pending())
+        pending.fields.update({key: value for key, value in fields.items() if value})
+        self.counters["staged"] += 1
+
+    def take(self, throw_id: int) -> Dict[str, Any]:
+        """Забрать накопленные поля броска (буфер для него очищается)"""
+        pending = self._pending.pop(throw_id, None)
+        return pending.fields if pending else {}
+
+    async def flush(self, session: AsyncSession, throw_id: int):
+        """Записать накопленное одним UPDATE в сессии вызывающего (коммитит он же)"""
+        fields = self.take(throw_id)
+        if fields:
+            await update_throw(session, throw_id, **fields)
+            self.counters["flushed_updates"] += 1
+
+    async def flush_all(self, older_than: float = 0.0):
+        """Записать буфер (или записи старше older_than сек) в одной транзакции"""
+        now = time.monotonic()
+        throw_ids = [
+            throw_id for throw_id, pending in self._pending.items()
+            if now - pending.staged_at >= older_than
+        ]
+        if not throw_ids:
+            return
+
+        batch = {throw_id: self.take(throw_id) for throw_id in throw_ids}
+        try:
+            async with self.session_factory() as session:
+                for throw_id, fields in batch.items():
+                    await update_throw(session, throw_id, **fields)
+                await session.commit()
+            self.counters["flushed_updates"] += len(batch)
+        except Exception as e:
+            # Возвращаем в буфер, не затирая то, что успели добавить за время записи
+            self.counters["flush_failures"] += 1
+            logger.error(f"Throw write-behind flush failed ({len(batch)} throws): {e}")
+            for throw_id, fields in batch.items():
+                pending = self._pending.setdefault(throw_id, _Pending())
+                pending.fields = {**fields, **pending.fields}
+            raise
+
+    async def _flush_due(self):
+        await self.flush_all(older_than=self.flush_delay)
+
+    def stats(self) -> Dict[str, int]:
+        return {"pending": len(self._pending), **self.counters}
+
+
+class LastInteractionBuffer(_PeriodicFlusher):
+    """Отметки активности: telegram_id -> время последнего апдейта"""
+
+    def __init__(self, session_factory: async_sessionmaker, flush_interval: float):
+        super().__init__()
+        self.session_factory = session_factory
+        self.check_interval = flush_interval
+        self._touched: Dict[str, datetime] = {}
+
+        self.counters = {"touches": 0, "flushes": 0, "flushed_users": 0, "flush_failures": 0}
+
+    def touch(self, telegram_id: str):
+        """Отметить активность пользователя (без обращения к базе)"""
+        self._touched[telegram_id] = datetime.utcnow()
+        self.counters["touches"] += 1
+
+    async def flush_all(self):
+        """Записать все отметки одним пакетным UPDATE"""
+        if not self._touched:
+            return
+
+        batch, self._touched = self._touched, {}
+        try:
+            async with self.session_factory() as session:
+                await update_last_interactions(session, batch)
+                await session.commit()
+            self.counters["flushes"] += 1
+            self.counters["flushed_users"] += len(batch)
+        except Exception as e:
+            self.counters["flush_failures"] += 1
+            logger.error(f"last_interaction flush failed ({len(batch)} users): {e}")
+            for telegram_id, ts in batch.items():
+                if ts > self._touched.get(telegram_id, datetime.min):
+                    self._touched[telegram_id] = ts
+            raise
+
+    async def _flush_due(self):
+        await self.flush_all()
+
+    def stats(self) -> Dict[str, int]:
+        return {"pending": len(self._touched), **self.counters}
+
+
+# Общий буфер изменений бросков
+throw_writes = ThrowWriteBuffer(SessionLocal, THROW_WRITE_DELAY)
+# Общий буфер отметок активности пользователей
+interactions = LastInteractionBuffer(SessionLocal, LAST_INTERACTION_FLUSH_INTERVAL)